@@ -5,37 +5,54 @@ import re
 # --- CONFIG ---
 DB_FILE = "photo_library.db"
 TARGET_YEAR = "1997"  # Change this to match your folder/filename pattern
+PATH_SEP = "\n"  # GROUP_CONCAT separator (commas can appear in real paths)
+
+def connect_db():
+    """Opens the library DB with the same PRAGMA bundle the ingest apps use."""
+    conn = sqlite3.connect(DB_FILE)
+    conn.executescript(
+        "PRAGMA journal_mode=WAL;"
+        "PRAGMA synchronous=NORMAL;"
+        "PRAGMA cache_size=-65536;"
+        "PRAGMA temp_store=MEMORY;"
+        "PRAGMA mmap_size=268435456;"
+    )
+    return conn
 
 def run_scout():
     print(f"🕵️  Scouting for duplicates containing '{TARGET_YEAR}'...")
     
-    conn = sqlite3.connect(DB_FILE)
+    conn = connect_db()
     cursor = conn.cursor()
     
-    # Get all cluster IDs
-    cluster_ids = [x[0] for x in cursor.execute("SELECT DISTINCT cluster_id FROM clusters").fetchall()]
+    # Index the join so SQLite seeks instead of scanning
+    # Same covering index v10 builds (and v10 drops a bare cluster_id one), so the tools agree on it
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_clusters_cid_imgid ON clusters(cluster_id, image_id, is_winner)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_id ON images(id)")
+    
+    # One query for every cluster: SQLite does the grouping and the Target Year filter
+    query = '''SELECT c.cluster_id, GROUP_CONCAT(i.path, ?)
+               FROM clusters c
+               JOIN images i ON c.image_id = i.id
+               GROUP BY c.cluster_id
+               HAVING SUM(i.path LIKE ?) > 0 AND COUNT(*) >= 2'''
     
     match_count = 0
     
     print(f"\n{'FILE A':<30} | {'FILE B':<30}")
     print("-" * 65)
     
-    for cid in cluster_ids:
-        # Get paths in this cluster
-        query = "SELECT images.path FROM clusters JOIN images ON clusters.image_id = images.id WHERE clusters.cluster_id = ?"
-        paths = [row[0] for row in cursor.execute(query, (cid,)).fetchall()]
-        
-        # Filter: Only look at clusters where at least one file matches the Target Year
-        if any(TARGET_YEAR in p for p in paths) and len(paths) >= 2:
-            # Just taking the first two for display comparison
-            name_a = os.path.basename(paths[0])
-            name_b = os.path.basename(paths[1])
-            print(f"{name_a:<30} | {name_b:<30}")
-            match_count += 1
+    for cid, joined in cursor.execute(query, (PATH_SEP, f"%{TARGET_YEAR}%")):
+        paths = joined.split(PATH_SEP)
+        # Just taking the first two for display comparison
+        name_a = os.path.basename(paths[0])
+        name_b = os.path.basename(paths[1])
+        print(f"{name_a:<30} | {name_b:<30}")
+        match_count += 1
             
     conn.close()
     print("-" * 65)
     print(f"Found {match_count} clusters involving '{TARGET_YEAR}'")
 
 if __name__ == "__main__":
-    run_scout()
\ No newline at end of file
+    run_scout()
@@ -7,6 +7,7 @@ from send2trash import send2trash
 # --- CONFIGURATION ---
 CLUSTER_DIR = "clusters"      # Where your grouped duplicate folders are
 OUTPUT_DIR = "final_album"    # Where the "winners" go
+VALID_EXTS = ('.jpg', '.jpeg', '.png', '.webp')  # Lowercase; compared against name.lower()
 # ---------------------
 
 # Ensure output directory exists
@@ -16,8 +17,9 @@ st.set_page_config(layout="wide", page_title="High-Perf Photo Curator")
 
 # --- HELPER FUNCTIONS ---
 
-def get_clusters():
-    """Scans the directory for subfolders (clusters)."""
+@st.cache_data(ttl=10)
+def get_clusters(cluster_dir_mtime):
+    """Scans the directory for subfolders (clusters). Cached until CLUSTER_DIR changes."""
     if not os.path.exists(CLUSTER_DIR):
         return []
     # Get all subdirectories that contain images
@@ -27,16 +29,12 @@ def get_clusters():
 
 def load_images_in_cluster(cluster_path):
     """Loads image paths from a specific cluster folder."""
-    valid_exts = ('.jpg', '.jpeg', '.png', '.webp')
-    files = [
-        os.path.join(cluster_path, f) 
-        for f in os.listdir(cluster_path) 
-        if f.lower().endswith(valid_exts)
-    ]
+    with os.scandir(cluster_path) as it:
+        files = [e.path for e in it if e.name.lower().endswith(VALID_EXTS)]
     return sorted(files)
 
-def finalize_cluster(keeper_path, cluster_path, all_images):
-    """Moves the winner to Final Album, trashes the rest, removes empty cluster folder."""
+def finalize_cluster(keeper_path, cluster_path):
+    """Moves the winner to Final Album, then trashes the cluster folder with the rest."""
     
     # 1. Move the Keeper
     file_name = os.path.basename(keeper_path)
@@ -49,19 +47,16 @@ def finalize_cluster(keeper_path, cluster_path, all_images):
         
     shutil.move(keeper_path, dest_path)
     
-    # 2. Trash the Rejects (everything else in the list)
-    for img in all_images:
-        if img != keeper_path and os.path.exists(img):
-            send2trash(img) # Safely send to Recycle Bin
-            
-    # 3. Remove the now empty cluster folder
+    # 2. Trash the Rejects. They all live in the cluster folder, which now holds
+    #    nothing but rejects, so one send2trash on the folder replaces one
+    #    Recycle Bin round-trip per file.
     if os.path.exists(cluster_path):
-        # Check if empty before removing to be safe
+        # Nothing left (e.g. single-image cluster): just remove the folder
         if not os.listdir(cluster_path):
             os.rmdir(cluster_path)
         else:
-            # If random non-image files remain, send folder to trash
-            send2trash(cluster_path)
+            send2trash(cluster_path) # Safely send to Recycle Bin
+    get_clusters.clear()
 
 # --- APP LOGIC ---
 
@@ -72,7 +67,8 @@ if 'cluster_index' not in st.session_state:
     st.session_state.cluster_index = 0
 
 # Load directory structure
-all_clusters = get_clusters()
+cluster_dir_mtime = os.path.getmtime(CLUSTER_DIR) if os.path.exists(CLUSTER_DIR) else 0
+all_clusters = get_clusters(cluster_dir_mtime)
 
 if not all_clusters:
     st.success(f"🎉 No clusters found in '{CLUSTER_DIR}'. You are done!")
@@ -120,7 +116,7 @@ for idx, col in enumerate(cols):
 
         # The "Keep This One" Button
         if st.button(f"🏆 Keep\n{img_name}", key=img_path):
-            finalize_cluster(img_path, current_cluster_path, current_images)
+            finalize_cluster(img_path, current_cluster_path)
             # Move to next cluster automatically (creating a new list on rerun)
             # Note: We don't increment index because the current folder is now gone,
             # so the next folder in the list effectively slides into this index.
@@ -3,10 +3,14 @@ import os
 import shutil
 import sqlite3
 import cv2
-import imagehash
+import numpy as np
 import concurrent.futures
 from datetime import datetime
 from PIL import Image, ImageDraw, ImageFont
+try:
+    import numba # Optional: compiles the Detect kernel; NumPy bucket path otherwise
+except ImportError:
+    numba = None
 
 # --- CONFIGURATION ---
 DB_FILE = "./data/photo_library.db"
@@ -17,9 +21,26 @@ st.title("📚 Photo Detective v10: The Library Edition")
 
 # --- DATABASE MANAGEMENT ---
 
+def connect_db():
+    """Opens the library DB with WAL + relaxed fsync so batch commits are cheap."""
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False, isolation_level=None)
+    conn.executescript(
+        "PRAGMA journal_mode=WAL;"
+        "PRAGMA synchronous=NORMAL;"
+        "PRAGMA cache_size=-65536;"
+        "PRAGMA temp_store=MEMORY;"
+        "PRAGMA mmap_size=268435456;"
+    )
+    return conn
+
+@st.cache_resource
+def get_conn():
+    """One hot connection kept alive across Streamlit reruns (autocommit mode)."""
+    return connect_db()
+
 def init_db():
     """Creates the database tables if they don't exist."""
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_conn()
     c = conn.cursor()
     # Table to store file info
     c.execute('''CREATE TABLE IF NOT EXISTS images
@@ -30,23 +51,59 @@ def init_db():
                   sharpness INTEGER,
                   width INTEGER,
                   height INTEGER,
-                  status TEXT DEFAULT 'NEW')''') 
+                  status TEXT DEFAULT 'NEW',
+                  size INTEGER,
+                  mtime INTEGER)''') 
+    # Incremental ingest columns (added after v10 shipped, so migrate old DBs)
+    cols = {r[1] for r in c.execute("PRAGMA table_info(images)")}
+    for col in ("size", "mtime"):
+        if col not in cols: c.execute(f"ALTER TABLE images ADD COLUMN {col} INTEGER")
     # Table to store identified clusters
     c.execute('''CREATE TABLE IF NOT EXISTS clusters
                  (cluster_id INTEGER,
                   image_id INTEGER,
                   is_winner BOOLEAN)''')
-    conn.commit()
-    conn.close()
+    # Covering index for the Review join: cluster_id seek, image_id/is_winner read from the index.
+    # It also serves plain cluster_id lookups, so the older single-column index is redundant.
+    c.execute("CREATE INDEX IF NOT EXISTS idx_clusters_cid_imgid ON clusters(cluster_id, image_id, is_winner)")
+    c.execute("DROP INDEX IF EXISTS idx_clusters_cid")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_images_status ON images(status)")
 
-def get_db_count():
-    conn = sqlite3.connect(DB_FILE)
+def get_db_mtime():
+    """Change token for cached readers: the DB file plus its WAL side file."""
+    return tuple(os.path.getmtime(p) if os.path.exists(p) else 0
+                 for p in (DB_FILE, DB_FILE + "-wal"))
+
+@st.cache_data(ttl=30)
+def get_db_count(db_mtime):
+    conn = get_conn()
     c = conn.cursor()
-    c.execute("SELECT count(*) FROM images")
+    c.execute("SELECT count(*) FROM images WHERE phash IS NOT NULL")
     count = c.fetchone()[0]
-    conn.close()
     return count
 
+@st.cache_data(ttl=30)
+def load_cluster_ids(db_mtime):
+    conn = get_conn()
+    c_ids = [x[0] for x in conn.execute("SELECT DISTINCT cluster_id FROM clusters").fetchall()]
+    return c_ids
+
+@st.cache_data(ttl=30)
+def load_cluster_items(cid, db_mtime):
+    """Returns (path, is_winner, sharpness, width, height) rows for one cluster."""
+    conn = get_conn()
+    query = '''SELECT images.path, clusters.is_winner, images.sharpness, images.width, images.height
+               FROM clusters 
+               JOIN images ON clusters.image_id = images.id
+               WHERE clusters.cluster_id = ?'''
+    items = conn.execute(query, (cid,)).fetchall()
+    return items
+
+def clear_db_caches():
+    get_db_count.clear()
+    load_cluster_ids.clear()
+    load_cluster_items.clear()
+
 # --- IMAGE PROCESSING ---
 
 def get_timestamp(img_path):
@@ -61,25 +118,179 @@ def get_timestamp(img_path):
     except: return 0
     return 0
 
+def phash_from_gray(gray):
+    """imagehash.phash-style DCT hash computed on an already-decoded grayscale frame."""
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8]
+    # cv2.dct is orthonormal; rescale the DC row/col to match imagehash's unnormalized DCT
+    low[0, :] *= np.sqrt(2)
+    low[:, 0] *= np.sqrt(2)
+    bits = (low > np.median(low)).ravel()
+    return f"{int(''.join('1' if b else '0' for b in bits), 2):016x}"
+
+def iter_images(root, valid_exts):
+    """Yields (path, size, mtime) for images under root using scandir's cached entries."""
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        try:
+            with os.scandir(d) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.lower().endswith(valid_exts):
+                        info = entry.stat()
+                        yield (entry.path, info.st_size, int(info.st_mtime))
+        except OSError: continue
+
+def discover(conn, entries):
+    """Syncs crawled (path, size, mtime) rows into images; returns (new, changed) counts.
+
+    Unchanged files are skipped entirely. New or modified files are left with
+    phash NULL so 'Parse NEW' picks them up.
+    """
+    c = conn.cursor()
+    c.execute("CREATE TEMP TABLE IF NOT EXISTS todo (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER)")
+    c.execute("BEGIN IMMEDIATE")
+    c.execute("DELETE FROM todo")
+    c.executemany("INSERT OR IGNORE INTO todo VALUES (?,?,?)", entries)
+    # Modified since last parse -> reset for re-analysis
+    changed = c.execute('''UPDATE images SET size = t.size, mtime = t.mtime, phash = NULL, status = 'NEW'
+                           FROM todo t
+                           WHERE images.path = t.path AND images.size IS NOT NULL
+                             AND (images.size != t.size OR images.mtime != t.mtime)''').rowcount
+    # Rows indexed before size/mtime existed: backfill only, they are already parsed
+    c.execute('''UPDATE images SET size = t.size, mtime = t.mtime
+                 FROM todo t
+                 WHERE images.path = t.path AND images.size IS NULL''')
+    new = c.execute('''INSERT INTO images (path, size, mtime)
+                       SELECT t.path, t.size, t.mtime FROM todo t
+                       LEFT JOIN images i ON i.path = t.path
+                       WHERE i.path IS NULL''').rowcount
+    c.execute("COMMIT")
+    return new, changed
+
 def analyze_image(path):
     """The worker function."""
     try:
-        pil_img = Image.open(path)
-        h = str(imagehash.phash(pil_img)) # Store hash as string for DB
-        
+        # Single decode: phash, sharpness and dims all come from this frame
         cv_img = cv2.imread(path)
         if cv_img is None: return None
         
         gray = cv2.cvtColor(cv_img, cv2.COLOR_BGR2GRAY)
-        sharp = int(cv2.Laplacian(gray, cv2.CV_64F).var())
+        h = phash_from_gray(gray) # Store hash as hex string for DB
+        # int16 Laplacian is exact for uint8 input: same variance, 1/4 the bytes of CV_64F
+        sharp = int(cv2.Laplacian(gray, cv2.CV_16S).var())
         height, width, _ = cv_img.shape
         
+        # EXIF only needs the header; PIL does not decode pixels here
         ts = get_timestamp(path)
         
         return (path, h, ts, sharp, width, height)
     except:
         return None
 
+@st.cache_data(max_entries=256)
+def get_thumb(path, mtime):
+    """<=300px RGB preview. libjpeg decodes at 1/4 scale in the DCT domain, so the
+    full-resolution frame is never materialised. mtime is only the cache key."""
+    arr = cv2.imread(path, cv2.IMREAD_REDUCED_COLOR_4)
+    if arr is None: raise IOError(f"Cannot decode {path}")
+    h, w = arr.shape[:2]
+    scale = 300 / max(h, w)
+    if scale < 1:
+        arr = cv2.resize(arr, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(arr, cv2.COLOR_BGR2RGB)
+
+def cluster_windows(ts, hashes, sim_thresh, time_rad_sec, prog_bar, status):
+    """Greedy time-sorted clustering, one XOR + popcount pass per time window (pure NumPy path)."""
+    n = len(ts)
+    # Only look ahead in the sorted list, up to the end of the Time Radius.
+    # Missing timestamps (0) must be checked against everything.
+    end_scan = np.searchsorted(ts, ts + time_rad_sec, side="right")
+    end_scan[ts == 0] = n
+    
+    clusters = []
+    visited = np.zeros(n, dtype=bool)
+    
+    for i in range(n):
+        if visited[i]: continue
+        visited[i] = True
+        
+        cand = np.arange(i + 1, end_scan[i])
+        cand = cand[~visited[i + 1:end_scan[i]]]
+        
+        # Hash Check (whole window in one XOR + popcount pass)
+        dist = np.bitwise_count(hashes[cand] ^ hashes[i])
+        matches = cand[dist <= sim_thresh]
+        visited[matches] = True
+
+        if len(matches):
+            clusters.append(np.concatenate(([i], matches)))
+        
+        if i % 100 == 0:
+            prog_bar.progress((i+1)/n)
+            status.text(f"Scanned {i}/{n}...")
+    return clusters
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _popcount64(x):
+        x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+        x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+        x = (x + (x >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+        return np.int64((x * np.uint64(0x0101010101010101)) >> np.uint64(56))
+
+    @numba.njit(cache=True)
+    def cluster_soa(ts, hashes, sim_thresh, time_rad_sec):
+        """Same greedy walk as the original Python loop, compiled. Returns a cluster
+        label per row (-1 = no duplicates), numbered in seed order."""
+        n = ts.shape[0]
+        labels = np.full(n, -1, np.int64)
+        visited = np.zeros(n, np.bool_)
+        next_id = 0
+        for i in range(n):
+            if visited[i]: continue
+            visited[i] = True
+            found = False
+            for j in range(i + 1, n):
+                if visited[j]: continue
+                # Sorted by time: past the radius we can stop, unless a timestamp is missing (0)
+                if ts[i] != 0 and ts[j] != 0 and abs(ts[j] - ts[i]) > time_rad_sec: break
+                if _popcount64(hashes[i] ^ hashes[j]) <= sim_thresh:
+                    labels[j] = next_id
+                    visited[j] = True
+                    found = True
+            if found:
+                labels[i] = next_id
+                next_id += 1
+        return labels
+
+def labels_to_clusters(labels):
+    """Groups row indices by label, keeping seed order and ascending members."""
+    order = np.argsort(labels, kind="stable")
+    order = order[labels[order] >= 0]
+    bounds = np.flatnonzero(np.diff(labels[order])) + 1
+    return np.split(order, bounds) if len(order) else []
+
+# --- FILE ACTIONS ---
+
+@st.cache_resource
+def get_output_dirs():
+    """Creates Keepers/Discards once per server instead of on every click."""
+    keep_dir = os.path.join(OUTPUT_FOLDER, "Keepers")
+    disc_dir = os.path.join(OUTPUT_FOLDER, "Discards")
+    os.makedirs(keep_dir, exist_ok=True)
+    os.makedirs(disc_dir, exist_ok=True)
+    return keep_dir, disc_dir
+
+def link_or_copy(src, dst):
+    """Hard link when src and dst share a filesystem (no bytes copied), else copy2."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
 # --- UI COMPONENTS ---
 
 # Initialize DB on load
@@ -88,55 +299,54 @@ init_db()
 # SIDEBAR
 with st.sidebar:
     st.header("Library Stats")
-    total_files = get_db_count()
+    total_files = get_db_count(get_db_mtime())
     st.metric("Indexed Images", total_files)
     
     st.divider()
     st.header("1. Ingest")
     scan_path = st.text_input("Folder to Scan", "./input_photos")
-    workers = st.slider("Threads", 1, 16, 4)
-    if st.button("Scan & Add to Library", type="primary"):
-        # SCAN LOGIC
-        valid_exts = ('.jpg', '.jpeg', '.png', '.webp')
-        files_to_process = []
-        
+    workers = st.slider("Worker Processes", 1, 16, 4)
+    valid_exts = ('.jpg', '.jpeg', '.png', '.webp')
+    
+    # Step A: cheap discovery (stat only, no decoding)
+    if st.button("Discover", type="primary"):
         st.write("🔍 Crawling folder...")
-        existing_paths = set()
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("SELECT path FROM images")
-        for row in c.fetchall():
-            existing_paths.add(row[0])
-        conn.close()
-
-        for root, _, files in os.walk(scan_path):
-            for f in files:
-                if f.lower().endswith(valid_exts):
-                    full_path = os.path.join(root, f)
-                    if full_path not in existing_paths:
-                        files_to_process.append(full_path)
+        conn = get_conn()
+        new, changed = discover(conn, iter_images(scan_path, valid_exts))
+        clear_db_caches()
+        st.success(f"Discovered {new} new and {changed} changed images. Run 'Parse NEW' next.")
+    
+    # Step B: expensive analysis, only for rows that still lack a phash
+    if st.button("Parse NEW"):
+        conn = get_conn()
+        files_to_process = [r[0] for r in conn.execute(
+            "SELECT path FROM images WHERE phash IS NULL AND status = 'NEW'")]
         
         if not files_to_process:
-            st.warning("No new images found in this folder.")
+            st.warning("Nothing to parse. Run 'Discover' first.")
         else:
             st.info(f"Found {len(files_to_process)} new images. analyzing...")
             prog = st.progress(0)
             
-            # BATCH INSERT
+            # BATCH UPDATE
             batch_data = []
-            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
-                results = list(executor.map(analyze_image, files_to_process))
-                
-                for i, res in enumerate(results):
-                    if res: batch_data.append(res)
-                    prog.progress((i+1)/len(results))
+            failed = []
+            # Processes, not threads: phash + EXIF parsing hold the GIL
+            total = len(files_to_process)
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                results = executor.map(analyze_image, files_to_process, chunksize=32)
+                for i, (f_path, res) in enumerate(zip(files_to_process, results)):
+                    if res: batch_data.append(res[1:] + (res[0],))
+                    else: failed.append((f_path,))
+                    prog.progress((i+1)/total)
             
-            # Write to DB
-            conn = sqlite3.connect(DB_FILE)
+            # Write to DB (unreadable files are flagged so they aren't retried every run)
             c = conn.cursor()
-            c.executemany("INSERT OR IGNORE INTO images (path, phash, timestamp, sharpness, width, height) VALUES (?,?,?,?,?,?)", batch_data)
-            conn.commit()
-            conn.close()
+            c.execute("BEGIN IMMEDIATE")
+            c.executemany("UPDATE images SET phash=?, timestamp=?, sharpness=?, width=?, height=? WHERE path=?", batch_data)
+            c.executemany("UPDATE images SET status='ERROR' WHERE path=?", failed)
+            c.execute("COMMIT")
+            clear_db_caches()
             st.success(f"Added {len(batch_data)} images to the Library!")
             st.rerun()
 
@@ -147,96 +357,62 @@ with st.sidebar:
     
     if st.button("Find Global Duplicates"):
         st.write("🧠 Loading Library Data...")
-        conn = sqlite3.connect(DB_FILE)
+        conn = get_conn()
         # Load data into memory for fast comparison (100k dicts is handled by RAM easily, images are not)
         # Row: 0-id, 1-path, 2-hash, 3-ts, 4-sharp, 5-w, 6-h
-        rows = conn.execute("SELECT * FROM images WHERE status='NEW'").fetchall()
-        conn.close()
+        rows = conn.execute('''SELECT id, path, phash, timestamp, sharpness, width, height
+                               FROM images WHERE status='NEW' AND phash IS NOT NULL''').fetchall()
         
         if not rows:
             st.warning("Library is empty or all processed.")
             st.stop()
 
         # PREPARE DATA STRUCTURES
-        # Convert hex hash string back to ImageHash object for math
-        data_objs = []
+        # Struct-of-arrays: one contiguous column per field instead of a dict per row.
+        # Rows whose hash/dims can't be parsed are skipped.
+        good = []
         for r in rows:
             try:
-                data_objs.append({
-                    'id': r[0],
-                    'path': r[1],
-                    'hash': imagehash.hex_to_hash(r[2]),
-                    'ts': r[3],
-                    'score': r[4] + (r[5]*r[6]/10000) # Sharpness + Res Score
-                })
+                good.append((r[0], r[1], int(r[2], 16), r[3] or 0, r[4] + (r[5]*r[6]/10000)))
             except: pass
-            
-        # CLUSTERING LOGIC (Optimized)
-        # Sort by Time to reduce comparison window
-        data_objs.sort(key=lambda x: x['ts'])
         
-        clusters = []
-        visited = set()
+        ids = np.fromiter((g[0] for g in good), dtype=np.int64, count=len(good))
+        hashes = np.fromiter((g[2] for g in good), dtype=np.uint64, count=len(good))
+        ts = np.fromiter((g[3] for g in good), dtype=np.int64, count=len(good))
+        score = np.fromiter((g[4] for g in good), dtype=np.float64, count=len(good)) # Sharpness + Res Score
+        
+        # CLUSTERING LOGIC (Optimized)
+        # Sort by Time to reduce comparison window (stable, so ties keep DB order)
+        order = np.argsort(ts, kind="stable")
+        ids, hashes, ts, score = ids[order], hashes[order], ts[order], score[order]
+        n = len(ids)
         
         prog_bar = st.progress(0)
         status = st.empty()
         
-        # Limit comparison window to avoid N^2 on 100k
-        # We compare an image only with others within the Time Radius in the sorted list
-        
-        window_size = 2000 # Safety buffer, usually enough for time radius
-        
-        for i in range(len(data_objs)):
-            if data_objs[i]['id'] in visited: continue
-            
-            img_a = data_objs[i]
-            current_cluster = [img_a]
-            visited.add(img_a['id'])
-            
-            # Only look ahead in the sorted list
-            # We stop looking if time difference > radius
-            start_scan = i + 1
-            
-            for j in range(start_scan, len(data_objs)):
-                img_b = data_objs[j]
-                if img_b['id'] in visited: continue
-                
-                # Time Check (Fastest)
-                diff_days = abs(img_a['ts'] - img_b['ts']) / 86400
-                if diff_days > time_rad:
-                    # Since list is sorted by time, if we exceed radius, we can stop checking this loop
-                    # UNLESS timestamps are 0 (missing), then we must check.
-                    if img_a['ts'] != 0 and img_b['ts'] != 0:
-                        break 
-                
-                # Hash Check
-                if (img_a['hash'] - img_b['hash']) <= sim_thresh:
-                    current_cluster.append(img_b)
-                    visited.add(img_b['id'])
-
-            if len(current_cluster) > 1:
-                clusters.append(current_cluster)
-            
-            if i % 100 == 0:
-                prog_bar.progress((i+1)/len(data_objs))
-                status.text(f"Scanned {i}/{len(data_objs)}...")
+        if numba is not None:
+            status.text(f"Clustering {n} images (native kernel)...")
+            clusters = labels_to_clusters(cluster_soa(ts, hashes, sim_thresh, time_rad * 86400))
+        else:
+            clusters = cluster_windows(ts, hashes, sim_thresh, time_rad * 86400, prog_bar, status)
+        prog_bar.progress(1.0)
 
         # SAVE CLUSTERS TO DB
-        conn = sqlite3.connect(DB_FILE)
+        conn = get_conn()
         c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
         c.execute("DELETE FROM clusters") # Clear old results
         
-        count = 0
-        for c_idx, clust in enumerate(clusters):
-            # Determine winner
-            winner = max(clust, key=lambda x: x['score'])
-            for item in clust:
-                is_win = (item == winner)
-                c.execute("INSERT INTO clusters VALUES (?,?,?)", (c_idx, item['id'], is_win))
-            count += 1
+        # Determine winners, then write every membership row in one executemany
+        rows = []
+        for c_idx, members in enumerate(clusters):
+            winner = members[np.argmax(score[members])]
+            rows.extend((c_idx, int(ids[j]), bool(j == winner)) for j in members)
+        c.executemany("INSERT INTO clusters VALUES (?,?,?)", rows)
+        count = len(clusters)
             
-        conn.commit()
-        conn.close()
+        c.execute("COMMIT")
+        clear_db_caches()
         st.success(f"Found {count} clusters! Go to Review Tab.")
 
 # --- MAIN TABS ---
@@ -244,11 +420,9 @@ with st.sidebar:
 t1, t2 = st.tabs(["Review Duplicates", "Tools"])
 
 with t1:
-    # Load Clusters from DB
-    conn = sqlite3.connect(DB_FILE)
-    # Get list of cluster IDs
-    c_ids = [x[0] for x in conn.execute("SELECT DISTINCT cluster_id FROM clusters").fetchall()]
-    conn.close()
+    # Load Clusters from DB (cached until the DB changes)
+    db_mtime = get_db_mtime()
+    c_ids = load_cluster_ids(db_mtime)
     
     if not c_ids:
         st.info("No duplicates found yet. Index folders and click 'Find Global Duplicates'.")
@@ -275,26 +449,19 @@ with t1:
         st.write(f"Page {st.session_state.page + 1} of {(len(c_ids)//ITEMS_PER_PAGE)+1}")
         
         # Render
-        conn = sqlite3.connect(DB_FILE)
         for cid in current_ids:
             st.divider()
             st.subheader(f"Cluster #{cid}")
             
             # Get items for this cluster
-            # Join with images table to get paths
-            query = '''SELECT images.path, clusters.is_winner, images.sharpness, images.width, images.height
-                       FROM clusters 
-                       JOIN images ON clusters.image_id = images.id
-                       WHERE clusters.cluster_id = ?'''
-            items = conn.execute(query, (cid,)).fetchall()
+            items = load_cluster_items(cid, db_mtime)
             
             cols = st.columns(len(items))
             for idx, item in enumerate(items):
                 path, is_win, sharp, w, h = item
                 with cols[idx]:
                     try:
-                        img = Image.open(path)
-                        img.thumbnail((300,300))
+                        img = get_thumb(path, os.path.getmtime(path))
                         
                         border = "green" if is_win else "red"
                         st.image(img, caption=os.path.basename(path))
@@ -303,29 +470,31 @@ with t1:
                         
                         if st.button(f"Keep This", key=f"keep_{path}_{cid}"):
                             # ACTION LOGIC
+                            keep_dir, disc_dir = get_output_dirs()
                             # 1. Move winner to keep
-                            keep_dir = os.path.join(OUTPUT_FOLDER, "Keepers")
-                            os.makedirs(keep_dir, exist_ok=True)
-                            shutil.copy2(path, os.path.join(keep_dir, os.path.basename(path)))
+                            link_or_copy(path, os.path.join(keep_dir, os.path.basename(path)))
                             
                             # 2. Move others to discard
-                            disc_dir = os.path.join(OUTPUT_FOLDER, "Discards")
-                            os.makedirs(disc_dir, exist_ok=True)
-                            
                             for sub_item in items:
                                 sub_path = sub_item[0]
                                 if sub_path != path:
-                                    shutil.copy2(sub_path, os.path.join(disc_dir, os.path.basename(sub_path)))
+                                    link_or_copy(sub_path, os.path.join(disc_dir, os.path.basename(sub_path)))
                                     
                             st.success("Processed!")
                     except:
                         st.error("Missing File")
-        conn.close()
 
 with t2:
     st.write("Database Maintenance")
     if st.button("⚠️ Wipe Database (Reset All)"):
         if os.path.exists(DB_FILE):
+            # Release the shared connection before deleting the file under it
+            get_conn().close()
+            get_conn.clear()
             os.remove(DB_FILE)
+            # WAL mode leaves side files next to the DB
+            for side in (DB_FILE + "-wal", DB_FILE + "-shm"):
+                if os.path.exists(side): os.remove(side)
+            clear_db_caches()
             st.success("Reset complete.")
             st.rerun()
\ No newline at end of file
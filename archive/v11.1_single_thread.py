@@ -3,9 +3,10 @@ import os
 import shutil
 import sqlite3
 import cv2
-import imagehash
+import numpy as np
 import warnings
 import gc # Garbage Collection
+import time
 from datetime import datetime
 from PIL import Image
 
@@ -16,14 +17,34 @@ os.environ["OPENCV_LOG_LEVEL"] = "OFF"
 # --- CONFIG ---
 DB_FILE = "photo_library.db"
 OUTPUT_FOLDER = "sorted_photos"
+UPDATE_SQL = "UPDATE images SET phash=?, timestamp=?, sharpness=?, width=?, height=? WHERE path=?"
+FLUSH_EVERY = 256 # Commits are WAL appends now, so batches can be larger
+UI_UPDATE_SECS = 0.25
 
 st.set_page_config(page_title="Photo Detective v11.1 (Single Thread)", layout="wide")
 st.title("🚜 Photo Detective v11.1: The Tractor")
 st.markdown("Single-threaded. Low memory. Shows exactly what file is processing.")
 
 # --- DB & HELPERS ---
+def connect_db():
+    """Opens the library DB with WAL + relaxed fsync so batch commits are cheap."""
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False, isolation_level=None)
+    conn.executescript(
+        "PRAGMA journal_mode=WAL;"
+        "PRAGMA synchronous=NORMAL;"
+        "PRAGMA cache_size=-65536;"
+        "PRAGMA temp_store=MEMORY;"
+        "PRAGMA mmap_size=268435456;"
+    )
+    return conn
+
+@st.cache_resource
+def get_conn():
+    """One hot connection kept alive across Streamlit reruns (autocommit mode)."""
+    return connect_db()
+
 def init_db():
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_conn()
     c = conn.cursor()
     c.execute('''CREATE TABLE IF NOT EXISTS images
                  (id INTEGER PRIMARY KEY,
@@ -33,21 +54,24 @@ def init_db():
                   sharpness INTEGER,
                   width INTEGER,
                   height INTEGER,
-                  status TEXT DEFAULT 'NEW')''') 
+                  status TEXT DEFAULT 'NEW',
+                  size INTEGER,
+                  mtime INTEGER)''') 
+    # Incremental ingest columns (added after v10 shipped, so migrate old DBs)
+    cols = {r[1] for r in c.execute("PRAGMA table_info(images)")}
+    for col in ("size", "mtime"):
+        if col not in cols: c.execute(f"ALTER TABLE images ADD COLUMN {col} INTEGER")
     c.execute('''CREATE TABLE IF NOT EXISTS clusters
                  (cluster_id INTEGER,
                   image_id INTEGER,
                   is_winner BOOLEAN)''')
-    conn.commit()
-    conn.close()
 
 def get_db_count():
     try:
-        conn = sqlite3.connect(DB_FILE)
+        conn = get_conn()
         c = conn.cursor()
-        c.execute("SELECT count(*) FROM images")
+        c.execute("SELECT count(*) FROM images WHERE phash IS NOT NULL")
         val = c.fetchone()[0]
-        conn.close()
         return val
     except: return 0
 
@@ -63,18 +87,77 @@ def get_timestamp(img_path):
     except: return 0
     return 0
 
+def phash_from_gray(gray):
+    """imagehash.phash-style DCT hash computed on an already-decoded grayscale frame."""
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8]
+    # cv2.dct is orthonormal; rescale the DC row/col to match imagehash's unnormalized DCT
+    low[0, :] *= np.sqrt(2)
+    low[:, 0] *= np.sqrt(2)
+    bits = (low > np.median(low)).ravel()
+    return f"{int(''.join('1' if b else '0' for b in bits), 2):016x}"
+
+def iter_images(root, valid_exts):
+    """Yields (path, size, mtime) for images under root using scandir's cached entries."""
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        try:
+            with os.scandir(d) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.lower().endswith(valid_exts):
+                        info = entry.stat()
+                        yield (entry.path, info.st_size, int(info.st_mtime))
+        except OSError: continue
+
+def discover(conn, entries):
+    """Syncs crawled (path, size, mtime) rows into images; returns (new, changed) counts.
+
+    Unchanged files are skipped entirely. New or modified files are left with
+    phash NULL so 'Parse NEW' picks them up.
+    """
+    c = conn.cursor()
+    c.execute("CREATE TEMP TABLE IF NOT EXISTS todo (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER)")
+    c.execute("BEGIN IMMEDIATE")
+    c.execute("DELETE FROM todo")
+    c.executemany("INSERT OR IGNORE INTO todo VALUES (?,?,?)", entries)
+    # Modified since last parse -> reset for re-analysis
+    changed = c.execute('''UPDATE images SET size = t.size, mtime = t.mtime, phash = NULL, status = 'NEW'
+                           FROM todo t
+                           WHERE images.path = t.path AND images.size IS NOT NULL
+                             AND (images.size != t.size OR images.mtime != t.mtime)''').rowcount
+    # Rows indexed before size/mtime existed: backfill only, they are already parsed
+    c.execute('''UPDATE images SET size = t.size, mtime = t.mtime
+                 FROM todo t
+                 WHERE images.path = t.path AND images.size IS NULL''')
+    new = c.execute('''INSERT INTO images (path, size, mtime)
+                       SELECT t.path, t.size, t.mtime FROM todo t
+                       LEFT JOIN images i ON i.path = t.path
+                       WHERE i.path IS NULL''').rowcount
+    c.execute("COMMIT")
+    return new, changed
+
+def save_batch(conn, rows, failed=()):
+    """One transaction per batch; sqlite3 reuses the prepared UPDATE_SQL statement.
+
+    Unreadable files are flagged ERROR so 'Parse NEW' doesn't retry them every run.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    conn.executemany(UPDATE_SQL, (res[1:] + (res[0],) for res in rows))
+    conn.executemany("UPDATE images SET status='ERROR' WHERE path=?", ((p,) for p in failed))
+    conn.execute("COMMIT")
+
 def analyze_image(path):
     try:
-        # Load Pillow
-        pil_img = Image.open(path)
-        h = str(imagehash.phash(pil_img))
-        pil_img.close() # Explicit close to free RAM
-        
-        # Load OpenCV
+        # Load OpenCV (single decode, phash comes from the same frame)
         cv_img = cv2.imread(path)
         if cv_img is None: return None
         gray = cv2.cvtColor(cv_img, cv2.COLOR_BGR2GRAY)
-        sharp = int(cv2.Laplacian(gray, cv2.CV_64F).var())
+        h = phash_from_gray(gray)
+        # int16 Laplacian is exact for uint8 input: same variance, 1/4 the bytes of CV_64F
+        sharp = int(cv2.Laplacian(gray, cv2.CV_16S).var())
         height, width, _ = cv_img.shape
         
         # Cleanup OpenCV
@@ -101,85 +184,75 @@ with st.sidebar:
     
     # NO THREAD SLIDER NEEDED - WE ARE RUNNING ON 1 CORE
     
-    if st.button("Start Safe Scan", type="primary"):
+    # Step A: cheap discovery (stat only, no decoding)
+    if st.button("Discover", type="primary"):
         if not os.path.exists(scan_path):
             st.error("Folder not found!")
         else:
             valid_exts = ('.jpg', '.jpeg', '.png', '.webp', '.heic')
-            files_to_process = []
             
-            st.write("Checking DB for known files...")
-            existing_paths = set()
-            conn = sqlite3.connect(DB_FILE)
-            c = conn.cursor()
-            c.execute("SELECT path FROM images")
-            for row in c.fetchall(): existing_paths.add(row[0])
-            conn.close()
-
-            st.write("Crawling folder...")
-            for root, _, files in os.walk(scan_path):
-                for f in files:
-                    if f.lower().endswith(valid_exts):
-                        full_path = os.path.join(root, f)
-                        if full_path not in existing_paths:
-                            files_to_process.append(full_path)
+            st.write("Crawling folder & checking DB for known files...")
+            new, changed = discover(get_conn(), iter_images(scan_path, valid_exts))
+            st.success(f"Discovered {new} new and {changed} changed images. Run 'Parse NEW' next.")
+    
+    # Step B: expensive analysis, only for rows that still lack a phash
+    if st.button("Parse NEW"):
+        conn = get_conn()
+        files_to_process = [r[0] for r in conn.execute(
+            "SELECT path FROM images WHERE phash IS NULL AND status = 'NEW'")]
+        
+        if not files_to_process:
+            st.warning("Nothing to parse. Run 'Discover' first.")
+        else:
+            st.info(f"Processing {len(files_to_process)} new images one by one...")
+            
+            prog = st.progress(0)
+            current_file_text = st.empty() # Shows exactly what file is busy
             
-            if not files_to_process:
-                st.warning("No new images found.")
-            else:
-                st.info(f"Processing {len(files_to_process)} new images one by one...")
+            chunk_buffer = []
+            failed = []
+            total_processed = 0
+            base_count = get_db_count() # Live metric = base + saved, no re-query per flush
+            last_ui = 0.0
+            
+            # SEQUENTIAL LOOP (No ThreadPool)
+            for i, f_path in enumerate(files_to_process):
                 
-                prog = st.progress(0)
-                current_file_text = st.empty() # Shows exactly what file is busy
+                # Update UI BEFORE processing, at most 4x/sec (each update is a websocket message)
+                now = time.monotonic()
+                if now - last_ui >= UI_UPDATE_SECS:
+                    last_ui = now
+                    current_file_text.text(f"Processing: {os.path.basename(f_path)}")
+                    prog.progress((i+1)/len(files_to_process))
                 
-                chunk_buffer = []
-                total_processed = 0
+                # Run Analysis
+                res = analyze_image(f_path)
                 
-                # SEQUENTIAL LOOP (No ThreadPool)
-                for i, f_path in enumerate(files_to_process):
+                if res:
+                    chunk_buffer.append(res)
+                    total_processed += 1
+                else:
+                    failed.append(f_path)
                     
-                    # Update UI BEFORE processing
-                    fname = os.path.basename(f_path)
-                    current_file_text.text(f"Processing: {fname}")
+                # Save every FLUSH_EVERY images
+                if len(chunk_buffer) >= FLUSH_EVERY:
+                    save_batch(conn, chunk_buffer)
+                    chunk_buffer = []
                     
-                    # Run Analysis
-                    res = analyze_image(f_path)
+                    # Aggressive Memory Cleanup
+                    gc.collect() 
                     
-                    if res:
-                        chunk_buffer.append(res)
-                        total_processed += 1
-                        
-                    # Save every 20 images (Frequent saves)
-                    if len(chunk_buffer) >= 20:
-                        conn = sqlite3.connect(DB_FILE)
-                        c = conn.cursor()
-                        c.executemany("INSERT OR IGNORE INTO images (path, phash, timestamp, sharpness, width, height) VALUES (?,?,?,?,?,?)", chunk_buffer)
-                        conn.commit()
-                        conn.close()
-                        chunk_buffer = []
-                        
-                        # Aggressive Memory Cleanup
-                        gc.collect() 
-                        
-                        stats_ph.metric("Indexed Images", get_db_count())
-
-                    # Update Progress
-                    if i % 5 == 0:
-                        prog.progress((i+1)/len(files_to_process))
-                
-                # Save Remainder
-                if chunk_buffer:
-                    conn = sqlite3.connect(DB_FILE)
-                    c = conn.cursor()
-                    c.executemany("INSERT OR IGNORE INTO images (path, phash, timestamp, sharpness, width, height) VALUES (?,?,?,?,?,?)", chunk_buffer)
-                    conn.commit()
-                    conn.close()
-
-                prog.progress(1.0)
-                current_file_text.text("Done!")
-                st.success("Finished!")
-                st.balloons()
-                st.rerun()
+                    stats_ph.metric("Indexed Images", base_count + total_processed)
+            
+            # Save Remainder
+            if chunk_buffer or failed:
+                save_batch(conn, chunk_buffer, failed)
+
+            prog.progress(1.0)
+            current_file_text.text("Done!")
+            st.success("Finished!")
+            st.balloons()
+            st.rerun()
 
     st.divider()
     st.header("2. Detect")
@@ -1,10 +1,16 @@
 import streamlit as st
 import os
+import io
 import shutil
 import sqlite3
 import cv2
+import concurrent.futures
 import imagehash
 import warnings
+import hashlib
+from functools import lru_cache
+from itertools import groupby
+from operator import itemgetter
 from datetime import datetime
 from PIL import Image, ImageDraw, ImageFont
 
@@ -21,30 +27,132 @@ st.set_page_config(page_title="Photo Detective v12.1", layout="wide")
 st.title("🎨 Photo Detective v12.1: The Curator")
 
 # --- DATABASE & HELPERS ---
+PRAGMA_SCRIPT = (
+    "PRAGMA journal_mode=WAL;"
+    "PRAGMA synchronous=NORMAL;"
+    "PRAGMA cache_size=-65536;"
+    "PRAGMA temp_store=MEMORY;"
+    "PRAGMA mmap_size=268435456;"
+    "PRAGMA busy_timeout=60000;"
+)
+
+@st.cache_resource
 def get_db_connection():
-    return sqlite3.connect(DB_FILE)
+    """One shared connection per server process, so the PRAGMAs stick and reruns skip the open."""
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+    conn.executescript(PRAGMA_SCRIPT)
+    return conn
 
-def get_db_stats():
+@st.cache_resource
+def ensure_schema():
+    """Builds the lookup indexes and (re)seeds cluster_meta once per process."""
+    conn = get_db_connection()
+    try:
+        # Planner stats only need gathering when the indexes are new, not on every start
+        have = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        conn.executescript('''
+            CREATE INDEX IF NOT EXISTS idx_clusters_cid_iid ON clusters(cluster_id, image_id);
+            CREATE INDEX IF NOT EXISTS idx_images_id_path ON images(id, path, sharpness, width, height);
+            
+            -- Cluster totals maintained at write time (any tool writing clusters keeps them exact)
+            CREATE TABLE IF NOT EXISTS cluster_meta (cluster_count INTEGER, image_count INTEGER);
+            CREATE TRIGGER IF NOT EXISTS trg_clusters_ins AFTER INSERT ON clusters BEGIN
+                UPDATE cluster_meta SET image_count = image_count + 1,
+                    cluster_count = cluster_count + NOT EXISTS (SELECT 1 FROM clusters WHERE cluster_id = NEW.cluster_id AND rowid <> NEW.rowid);
+            END;
+            CREATE TRIGGER IF NOT EXISTS trg_clusters_del AFTER DELETE ON clusters BEGIN
+                UPDATE cluster_meta SET image_count = image_count - 1,
+                    cluster_count = cluster_count - NOT EXISTS (SELECT 1 FROM clusters WHERE cluster_id = OLD.cluster_id);
+            END;
+            BEGIN;
+            DELETE FROM cluster_meta;
+            INSERT INTO cluster_meta SELECT count(DISTINCT cluster_id), count(*) FROM clusters;
+            COMMIT;
+        ''')
+        if not {'idx_clusters_cid_iid', 'idx_images_id_path'} <= have: conn.execute("ANALYZE")
+    except sqlite3.Error as e:
+        if conn.in_transaction: conn.rollback()
+        st.warning(f"⚠️ Database setup failed ({e}). Stats and paging may be slow or stale.")
+
+def get_db_mtime():
+    """Change token for cached readers: the DB file plus its WAL side file."""
+    return tuple(os.path.getmtime(p) if os.path.exists(p) else 0
+                 for p in (DB_FILE, DB_FILE + "-wal"))
+
+@st.cache_data(show_spinner=False)
+def get_db_stats(db_mtime):
     try:
         conn = get_db_connection()
         # 1. Total Library Size
         img_count = conn.execute("SELECT count(*) FROM images").fetchone()[0]
-        # 2. Total Clusters (Groups)
-        cluster_count = conn.execute("SELECT count(DISTINCT cluster_id) FROM clusters").fetchone()[0]
-        # 3. Total Images Involved in Clusters (The Metric You Asked For)
-        clustered_img_count = conn.execute("SELECT count(*) FROM clusters").fetchone()[0]
-        conn.close()
+        # 2. Total Clusters (Groups) + 3. Total Images Involved in Clusters (O(1), trigger-maintained)
+        cluster_count, clustered_img_count = conn.execute("SELECT cluster_count, image_count FROM cluster_meta").fetchone()
         return img_count, cluster_count, clustered_img_count
     except: return 0, 0, 0
 
+@st.cache_data(show_spinner=False)
+def load_cluster_ids(db_token):
+    """Sorted cluster IDs; GROUP BY walks idx_clusters_cid_iid in order."""
+    try:
+        conn = get_db_connection()
+        ids = [x[0] for x in conn.execute("SELECT cluster_id FROM clusters GROUP BY cluster_id ORDER BY cluster_id").fetchall()]
+        return ids
+    except: return []
+
+def fetch_all_cluster_items(conn, cids=None):
+    """Returns [(cluster_id, [(path, is_winner, sharpness, w, h), ...]), ...] in one query."""
+    query = '''SELECT c.cluster_id, i.path, c.is_winner, i.sharpness, i.width, i.height
+               FROM clusters c JOIN images i ON c.image_id = i.id'''
+    params = ()
+    if cids is not None:
+        if not cids: return []
+        query += f" WHERE c.cluster_id IN ({','.join('?' * len(cids))})"
+        params = tuple(cids)
+    rows = conn.execute(query + " ORDER BY c.cluster_id", params).fetchall()
+    return [(cid, [r[1:] for r in grp]) for cid, grp in groupby(rows, key=itemgetter(0))]
+
 # --- VISUALIZATION ENGINE (The Filmstrip) ---
-def create_filmstrip(cluster_items, cluster_id):
-    """Stitches images side-by-side with metadata overlay."""
-    images = []
-    target_height = 400
+TARGET_HEIGHT = 400
+
+try: _FONT = ImageFont.truetype("arial.ttf", 30)
+except: _FONT = ImageFont.load_default()
+
+def render_tile(path, is_win, sharp, w, h, target_height):
+    """Decodes + resizes one photo into a bordered, labeled tile."""
+    # Context manager releases the file handle + decoded source as soon as we have the thumb
+    with Image.open(path) as src:
+        # Let libjpeg decode at 1/2, 1/4 or 1/8 scale when the source is much bigger
+        src.draft("RGB", (target_height * 4, target_height * 4))
+        aspect = src.width / src.height
+        new_w = int(target_height * aspect)
+        img = src.convert("RGB").resize((new_w, target_height), Image.BILINEAR)
+    
+    # Border Color
+    color = "#32CD32" if is_win else "#FF4500" # Green vs Red
+    border_w = 10
     
-    try: font = ImageFont.truetype("arial.ttf", 30)
-    except: font = ImageFont.load_default()
+    # Canvas
+    canvas = Image.new("RGB", (new_w + (border_w*2), target_height + 60), color)
+    canvas.paste(img, (border_w, border_w))
+    
+    # Text
+    draw = ImageDraw.Draw(canvas)
+    status = "🏆 Best" if is_win else "Duplicate"
+    info = f"{w}x{h} | Sharp:{sharp}"
+    
+    draw.text((15, target_height + 15), status, font=_FONT, fill="white")
+    draw.text((15, target_height + 35), info, font=_FONT, fill="white")
+    return canvas
+
+@st.cache_resource(max_entries=64)
+def _load_tile(path, mtime, is_win, sharp, w, h, target_height):
+    """UI path: tiles survive Streamlit reruns until the file changes."""
+    return render_tile(path, is_win, sharp, w, h, target_height)
+
+def create_filmstrip(cluster_items, cluster_id, cached=True):
+    """Stitches cached tiles side-by-side."""
+    images = []
+    target_height = TARGET_HEIGHT
 
     # Sort: Winner first
     sorted_items = sorted(cluster_items, key=lambda x: x[1], reverse=True) # Sort by is_winner
@@ -52,28 +160,10 @@ def create_filmstrip(cluster_items, cluster_id):
     for item in sorted_items:
         path, is_win, sharp, w, h = item
         try:
-            img = Image.open(path).convert("RGB")
-            aspect = img.width / img.height
-            new_w = int(target_height * aspect)
-            img = img.resize((new_w, target_height))
-            
-            # Border Color
-            color = "#32CD32" if is_win else "#FF4500" # Green vs Red
-            border_w = 10
-            
-            # Canvas
-            canvas = Image.new("RGB", (new_w + (border_w*2), target_height + 60), color)
-            canvas.paste(img, (border_w, border_w))
-            
-            # Text
-            draw = ImageDraw.Draw(canvas)
-            status = "🏆 Best" if is_win else "Duplicate"
-            info = f"{w}x{h} | Sharp:{sharp}"
-            
-            draw.text((15, target_height + 15), status, font=font, fill="white")
-            draw.text((15, target_height + 35), info, font=font, fill="white")
-            
-            images.append(canvas)
+            if cached:
+                images.append(_load_tile(path, os.path.getmtime(path), is_win, sharp, w, h, target_height))
+            else:
+                images.append(render_tile(path, is_win, sharp, w, h, target_height))
         except: pass
 
     if not images: return None
@@ -86,24 +176,56 @@ def create_filmstrip(cluster_items, cluster_id):
     for img in images:
         filmstrip.paste(img, (x_off, 0))
         x_off += img.width
+        if not cached: img.close() # Uncached tiles are ours to free
         
     return filmstrip
 
+@st.cache_data(show_spinner=False, max_entries=32)
+def filmstrip_jpeg(cluster_items, cluster_id):
+    """Encodes the filmstrip to JPEG once; st.image then ships the same bytes every rerun."""
+    strip = create_filmstrip(cluster_items, cluster_id)
+    if not strip: return None
+    buf = io.BytesIO()
+    strip.save(buf, "JPEG", quality=80, optimize=True)
+    strip.close()
+    return buf.getvalue()
+
+def _render_and_save(work):
+    """Export worker (top-level so the process pool can pickle it)."""
+    cid, items = work
+    strip = create_filmstrip(items, cid, cached=False)
+    if not strip: return False
+    strip.save(os.path.join(COLLAGE_FOLDER, f"Cluster_{cid:05d}.jpg"),
+               quality=85, optimize=True, progressive=True)
+    strip.close()
+    return True
+
 # --- ACTIONS ---
 
+def _fast_move(src, dst):
+    """Same-volume rename (no data copy), falling back to a full move."""
+    try: os.rename(src, dst)
+    except OSError: shutil.move(src, dst)
+
+@lru_cache(maxsize=4096)
+def path_key(path):
+    """Short stable widget key for a file path (keeps session state small)."""
+    return hashlib.blake2b(path.encode(), digest_size=8).hexdigest()
+
 def dissolve_cluster(cluster_id):
     """User wants to keep ALL images in this cluster (Not duplicates)."""
     conn = get_db_connection()
-    conn.execute("DELETE FROM clusters WHERE cluster_id = ?", (cluster_id,))
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute("DELETE FROM clusters WHERE cluster_id = ?", (cluster_id,))
+    get_db_stats.clear()
+    st.session_state.db_version += 1
 
 def keep_one(keep_path, cluster_items, cluster_id):
     """User selected one winner. Move others to Discards."""
     # 1. Move Winner
     k_dir = os.path.join(OUTPUT_FOLDER, "Keepers")
     os.makedirs(k_dir, exist_ok=True)
-    shutil.move(keep_path, os.path.join(k_dir, os.path.basename(keep_path)))
+    _fast_move(keep_path, os.path.join(k_dir, os.path.basename(keep_path)))
     
     # 2. Move Losers
     d_dir = os.path.join(OUTPUT_FOLDER, "Discards")
@@ -112,17 +234,26 @@ def keep_one(keep_path, cluster_items, cluster_id):
     for item in cluster_items:
         path = item[0]
         if path != keep_path and os.path.exists(path):
-            shutil.move(path, os.path.join(d_dir, os.path.basename(path)))
+            _fast_move(path, os.path.join(d_dir, os.path.basename(path)))
             
     # 3. Remove from DB display
     dissolve_cluster(cluster_id)
 
 # --- UI MAIN ---
 
+def sync_page():
+    """Paginator callback: runs before the rerun, so no st.rerun() is needed."""
+    st.session_state.page = st.session_state.page_num - 1
+
 t1, t2 = st.tabs(["🎞️ Filmstrip Review", "⚙️ Tools & Export"])
 
+ensure_schema()
+
 # Load Stats
-total_imgs, total_clusters, total_clustered_imgs = get_db_stats()
+# db_version is bumped by dissolve/keep so cached readers refresh immediately
+if 'db_version' not in st.session_state: st.session_state.db_version = 0
+db_token = (st.session_state.db_version, get_db_mtime())
+total_imgs, total_clusters, total_clustered_imgs = get_db_stats(db_token)
 
 with t1:
     if total_clusters == 0:
@@ -133,41 +264,35 @@ with t1:
         ITEMS_PER_PAGE = 5
         total_pages = (total_clusters - 1) // ITEMS_PER_PAGE + 1
         
-        # Nav Bar
-        c1, c2, c3 = st.columns([1, 4, 1])
+        # Clamp (keep/dissolve can shrink the page count) and seed the paginator
+        st.session_state.page = min(st.session_state.page, total_pages - 1)
+        st.session_state.page_num = st.session_state.page + 1
+        
+        # Nav Bar: one widget; changing it reruns the script by itself
+        c1, c2 = st.columns([1, 5])
         with c1: 
-            if st.button("⬅️ Previous") and st.session_state.page > 0: 
-                st.session_state.page -= 1
-                st.rerun()
+            st.number_input("Page", min_value=1, max_value=total_pages, key="page_num", on_change=sync_page)
         with c2: 
             # --- UPDATED STATS DISPLAY ---
             st.markdown(f"**Viewing Page {st.session_state.page + 1} of {total_pages}**")
             st.caption(f"Clusters: {total_clusters} | Images Involved: {total_clustered_imgs}")
-        with c3:
-            if st.button("Next ➡️") and st.session_state.page < total_pages - 1:
-                st.session_state.page += 1
-                st.rerun()
                 
         # Data Fetch
-        conn = get_db_connection()
-        c_ids = [x[0] for x in conn.execute("SELECT DISTINCT cluster_id FROM clusters").fetchall()]
-        conn.close()
+        c_ids = load_cluster_ids(db_token)
         
         start = st.session_state.page * ITEMS_PER_PAGE
         current_ids = c_ids[start : start + ITEMS_PER_PAGE]
         
         # RENDER LOOP
+        # Get Items for the whole page in one query: path, is_winner, sharpness, w, h
         conn = get_db_connection()
-        for cid in current_ids:
+        page_items = fetch_all_cluster_items(conn, current_ids)
+        
+        for cid, items in page_items:
             st.markdown("---")
-            # Get Items: path, is_winner, sharpness, w, h
-            query = '''SELECT images.path, clusters.is_winner, images.sharpness, images.width, images.height
-                       FROM clusters JOIN images ON clusters.image_id = images.id
-                       WHERE clusters.cluster_id = ?'''
-            items = conn.execute(query, (cid,)).fetchall()
             
             # 1. Generate Visual
-            filmstrip = create_filmstrip(items, cid)
+            filmstrip = filmstrip_jpeg(items, cid)
             if filmstrip:
                 st.image(filmstrip, use_container_width=False)
             
@@ -188,18 +313,12 @@ with t1:
                 name = os.path.basename(path)
                 with cols[idx+1]:
                     st.write(f"Candidate {idx+1}")
-                    if st.button(f"🏆 Keep This Only\n{name}", key=f"keep_{path}_{cid}"):
+                    if st.button(f"🏆 Keep This Only\n{name}", key=f"keep_{path_key(path)}_{cid}"):
                         keep_one(path, items, cid)
                         st.success("Sorted!")
                         st.rerun()
-        conn.close()
         
         st.markdown("---")
-        # Bottom Nav
-        if st.button("Next Page ➡️", key="next_btm"):
-             if st.session_state.page < total_pages - 1:
-                st.session_state.page += 1
-                st.rerun()
 
 with t2:
     st.header("Tools")
@@ -216,23 +335,15 @@ with t2:
         st.info("Generating collages... This might take a minute.")
         
         conn = get_db_connection()
-        all_cids = [x[0] for x in conn.execute("SELECT DISTINCT cluster_id FROM clusters").fetchall()]
+        all_items = fetch_all_cluster_items(conn)
         
         prog = st.progress(0)
-        for i, cid in enumerate(all_cids):
-            query = '''SELECT images.path, clusters.is_winner, images.sharpness, images.width, images.height
-                       FROM clusters JOIN images ON clusters.image_id = images.id
-                       WHERE clusters.cluster_id = ?'''
-            items = conn.execute(query, (cid,)).fetchall()
-            
-            strip = create_filmstrip(items, cid)
-            if strip:
-                save_path = os.path.join(COLLAGE_FOLDER, f"Cluster_{cid:05d}.jpg")
-                strip.save(save_path)
-            
-            if i % 10 == 0: prog.progress((i+1)/len(all_cids))
+        # Decode/stitch/encode is CPU-bound: fan clusters out across processes
+        workers = min(os.cpu_count() or 1, 8)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            for i, _ in enumerate(executor.map(_render_and_save, all_items, chunksize=8)):
+                if i % 10 == 0: prog.progress((i+1)/len(all_items))
             
-        conn.close()
         prog.progress(1.0)
         st.success(f"Done! Check the folder '{COLLAGE_FOLDER}'")
 
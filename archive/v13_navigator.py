@@ -1,10 +1,16 @@
 import streamlit as st
 import os
+import io
 import shutil
 import sqlite3
 import cv2
+import concurrent.futures
 import imagehash
 import warnings
+import hashlib
+from functools import lru_cache
+from itertools import groupby
+from operator import itemgetter
 from datetime import datetime
 from PIL import Image, ImageDraw, ImageFont
 
@@ -21,48 +27,131 @@ st.set_page_config(page_title="Photo Detective v13", layout="wide")
 st.title("🧭 Photo Detective v13: The Navigator")
 
 # --- DATABASE & HELPERS ---
+PRAGMA_SCRIPT = (
+    "PRAGMA journal_mode=WAL;"
+    "PRAGMA synchronous=NORMAL;"
+    "PRAGMA cache_size=-65536;"
+    "PRAGMA temp_store=MEMORY;"
+    "PRAGMA mmap_size=268435456;"
+    "PRAGMA busy_timeout=60000;"
+)
+
+@st.cache_resource
 def get_db_connection():
-    return sqlite3.connect(DB_FILE)
+    # One connection per server process: reruns skip open + PRAGMA setup
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+    conn.executescript(PRAGMA_SCRIPT)
+    return conn
 
-def get_db_stats():
+@st.cache_resource
+def ensure_schema():
+    """Builds the lookup indexes and (re)seeds cluster_meta once per process."""
+    conn = get_db_connection()
+    try:
+        # Planner stats only need gathering when the indexes are new, not on every start
+        have = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        conn.executescript('''
+            CREATE INDEX IF NOT EXISTS idx_clusters_cid_iid ON clusters(cluster_id, image_id);
+            CREATE INDEX IF NOT EXISTS idx_images_id_path ON images(id, path, sharpness, width, height);
+            
+            -- Cluster totals maintained at write time (any tool writing clusters keeps them exact)
+            CREATE TABLE IF NOT EXISTS cluster_meta (cluster_count INTEGER, image_count INTEGER);
+            CREATE TRIGGER IF NOT EXISTS trg_clusters_ins AFTER INSERT ON clusters BEGIN
+                UPDATE cluster_meta SET image_count = image_count + 1,
+                    cluster_count = cluster_count + NOT EXISTS (SELECT 1 FROM clusters WHERE cluster_id = NEW.cluster_id AND rowid <> NEW.rowid);
+            END;
+            CREATE TRIGGER IF NOT EXISTS trg_clusters_del AFTER DELETE ON clusters BEGIN
+                UPDATE cluster_meta SET image_count = image_count - 1,
+                    cluster_count = cluster_count - NOT EXISTS (SELECT 1 FROM clusters WHERE cluster_id = OLD.cluster_id);
+            END;
+            BEGIN;
+            DELETE FROM cluster_meta;
+            INSERT INTO cluster_meta SELECT count(DISTINCT cluster_id), count(*) FROM clusters;
+            COMMIT;
+        ''')
+        if not {'idx_clusters_cid_iid', 'idx_images_id_path'} <= have: conn.execute("ANALYZE")
+    except sqlite3.Error as e:
+        if conn.in_transaction: conn.rollback()
+        st.warning(f"⚠️ Database setup failed ({e}). Stats and paging may be slow or stale.")
+
+def get_db_mtime():
+    """Change token for cached readers: the DB file plus its WAL side file."""
+    return tuple(os.path.getmtime(p) if os.path.exists(p) else 0
+                 for p in (DB_FILE, DB_FILE + "-wal"))
+
+@st.cache_data(show_spinner=False)
+def get_db_stats(db_mtime):
     try:
         conn = get_db_connection()
         img_count = conn.execute("SELECT count(*) FROM images").fetchone()[0]
-        cluster_count = conn.execute("SELECT count(DISTINCT cluster_id) FROM clusters").fetchone()[0]
-        clustered_img_count = conn.execute("SELECT count(*) FROM clusters").fetchone()[0]
-        conn.close()
+        cluster_count, clustered_img_count = conn.execute("SELECT cluster_count, image_count FROM cluster_meta").fetchone()
         return img_count, cluster_count, clustered_img_count
     except: return 0, 0, 0
 
+@st.cache_data(show_spinner=False)
+def load_cluster_ids(db_token):
+    try:
+        conn = get_db_connection()
+        # GROUP BY walks idx_clusters_cid_iid in order, no temp b-tree for DISTINCT/ORDER
+        ids = [x[0] for x in conn.execute("SELECT cluster_id FROM clusters GROUP BY cluster_id ORDER BY cluster_id").fetchall()]
+        return ids
+    except: return []
+
+def fetch_all_cluster_items(conn, cids=None):
+    """Returns [(cluster_id, [(path, is_winner, sharpness, w, h), ...]), ...] in one query."""
+    query = '''SELECT c.cluster_id, i.path, c.is_winner, i.sharpness, i.width, i.height
+               FROM clusters c JOIN images i ON c.image_id = i.id'''
+    params = ()
+    if cids is not None:
+        if not cids: return []
+        query += f" WHERE c.cluster_id IN ({','.join('?' * len(cids))})"
+        params = tuple(cids)
+    rows = conn.execute(query + " ORDER BY c.cluster_id", params).fetchall()
+    return [(cid, [r[1:] for r in grp]) for cid, grp in groupby(rows, key=itemgetter(0))]
+
 # --- VISUALIZATION ENGINE ---
-def create_filmstrip(cluster_items, cluster_id):
+TARGET_HEIGHT = 400
+
+try: _FONT = ImageFont.truetype("arial.ttf", 30)
+except: _FONT = ImageFont.load_default()
+
+def render_tile(path, is_win, sharp, w, h, target_height):
+    with Image.open(path) as src:
+        src.draft("RGB", (target_height * 4, target_height * 4))
+        aspect = src.width / src.height
+        new_w = int(target_height * aspect)
+        img = src.convert("RGB").resize((new_w, target_height), Image.BILINEAR)
+    
+    color = "#32CD32" if is_win else "#FF4500" 
+    border_w = 10
+    canvas = Image.new("RGB", (new_w + (border_w*2), target_height + 60), color)
+    canvas.paste(img, (border_w, border_w))
+    
+    draw = ImageDraw.Draw(canvas)
+    status = "🏆 Best" if is_win else "Duplicate"
+    info = f"{w}x{h} | Sharp:{sharp}"
+    
+    draw.text((15, target_height + 15), status, font=_FONT, fill="white")
+    draw.text((15, target_height + 35), info, font=_FONT, fill="white")
+    return canvas
+
+@st.cache_resource(max_entries=64)
+def _load_tile(path, mtime, is_win, sharp, w, h, target_height):
+    return render_tile(path, is_win, sharp, w, h, target_height)
+
+def create_filmstrip(cluster_items, cluster_id, cached=True):
     images = []
-    target_height = 400
-    try: font = ImageFont.truetype("arial.ttf", 30)
-    except: font = ImageFont.load_default()
+    target_height = TARGET_HEIGHT
 
     sorted_items = sorted(cluster_items, key=lambda x: x[1], reverse=True) 
 
     for item in sorted_items:
         path, is_win, sharp, w, h = item
         try:
-            img = Image.open(path).convert("RGB")
-            aspect = img.width / img.height
-            new_w = int(target_height * aspect)
-            img = img.resize((new_w, target_height))
-            
-            color = "#32CD32" if is_win else "#FF4500" 
-            border_w = 10
-            canvas = Image.new("RGB", (new_w + (border_w*2), target_height + 60), color)
-            canvas.paste(img, (border_w, border_w))
-            
-            draw = ImageDraw.Draw(canvas)
-            status = "🏆 Best" if is_win else "Duplicate"
-            info = f"{w}x{h} | Sharp:{sharp}"
-            
-            draw.text((15, target_height + 15), status, font=font, fill="white")
-            draw.text((15, target_height + 35), info, font=font, fill="white")
-            images.append(canvas)
+            if cached:
+                images.append(_load_tile(path, os.path.getmtime(path), is_win, sharp, w, h, target_height))
+            else:
+                images.append(render_tile(path, is_win, sharp, w, h, target_height))
         except: pass
 
     if not images: return None
@@ -73,19 +162,47 @@ def create_filmstrip(cluster_items, cluster_id):
     for img in images:
         filmstrip.paste(img, (x_off, 0))
         x_off += img.width
+        if not cached: img.close() # Uncached tiles are ours to free
     return filmstrip
 
+@st.cache_data(show_spinner=False, max_entries=32)
+def filmstrip_jpeg(cluster_items, cluster_id):
+    strip = create_filmstrip(cluster_items, cluster_id)
+    if not strip: return None
+    buf = io.BytesIO()
+    strip.save(buf, "JPEG", quality=80, optimize=True)
+    strip.close()
+    return buf.getvalue()
+
+def _render_and_save(work):
+    cid, items = work
+    strip = create_filmstrip(items, cid, cached=False)
+    if not strip: return False
+    strip.save(os.path.join(COLLAGE_FOLDER, f"Cluster_{cid:05d}.jpg"),
+               quality=85, optimize=True, progressive=True)
+    strip.close()
+    return True
+
 # --- ACTIONS ---
+def _fast_move(src, dst):
+    try: os.rename(src, dst)
+    except OSError: shutil.move(src, dst)
+
+@lru_cache(maxsize=4096)
+def path_key(path):
+    return hashlib.blake2b(path.encode(), digest_size=8).hexdigest()
+
 def dissolve_cluster(cluster_id):
     conn = get_db_connection()
-    conn.execute("DELETE FROM clusters WHERE cluster_id = ?", (cluster_id,))
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute("DELETE FROM clusters WHERE cluster_id = ?", (cluster_id,))
+    get_db_stats.clear()
+    st.session_state.db_version += 1
 
 def keep_one(keep_path, cluster_items, cluster_id):
     k_dir = os.path.join(OUTPUT_FOLDER, "Keepers")
     os.makedirs(k_dir, exist_ok=True)
-    shutil.move(keep_path, os.path.join(k_dir, os.path.basename(keep_path)))
+    _fast_move(keep_path, os.path.join(k_dir, os.path.basename(keep_path)))
     
     d_dir = os.path.join(OUTPUT_FOLDER, "Discards")
     os.makedirs(d_dir, exist_ok=True)
@@ -93,21 +210,27 @@ def keep_one(keep_path, cluster_items, cluster_id):
     for item in cluster_items:
         path = item[0]
         if path != keep_path and os.path.exists(path):
-            shutil.move(path, os.path.join(d_dir, os.path.basename(path)))
+            _fast_move(path, os.path.join(d_dir, os.path.basename(path)))
     dissolve_cluster(cluster_id)
 
 # --- UI MAIN ---
 
+ensure_schema()
+
 # 1. Load Data Structure Early (For Navigation)
-total_imgs, total_clusters, total_clustered_imgs = get_db_stats()
+# Bumped by dissolve/keep so cached readers refresh without waiting on file mtimes
+if 'db_version' not in st.session_state: st.session_state.db_version = 0
+db_token = (st.session_state.db_version, get_db_mtime())
+total_imgs, total_clusters, total_clustered_imgs = get_db_stats(db_token)
 
-conn = get_db_connection()
-try:
-    # Get ALL cluster IDs sorted (so we can find index)
-    all_c_ids = [x[0] for x in conn.execute("SELECT DISTINCT cluster_id FROM clusters ORDER BY cluster_id ASC").fetchall()]
-except:
-    all_c_ids = []
-conn.close()
+# Get ALL cluster IDs sorted (so we can find index)
+all_c_ids = load_cluster_ids(db_token)
+
+# cluster_id -> position, rebuilt only when the DB changes
+if st.session_state.get('cid_index_token') != db_token:
+    st.session_state.cid_to_index = {cid: idx for idx, cid in enumerate(all_c_ids)}
+    st.session_state.cid_index_token = db_token
+cid_to_index = st.session_state.cid_to_index
 
 ITEMS_PER_PAGE = 5
 if total_clusters > 0:
@@ -117,6 +240,13 @@ else:
 
 # 2. Sidebar Navigation
 if 'page' not in st.session_state: st.session_state.page = 0
+# Clamp (keep/dissolve can shrink the page count) and seed the paginator widget
+st.session_state.page = min(st.session_state.page, total_pages - 1)
+st.session_state.page_num = st.session_state.page + 1
+
+def sync_page():
+    # Runs before the rerun that the widget change triggers, so no st.rerun() needed
+    st.session_state.page = st.session_state.page_num - 1
 
 with st.sidebar:
     st.header("🚀 Navigation")
@@ -126,27 +256,23 @@ with st.sidebar:
     nav_mode = st.radio("Jump Method:", ["Go to Page Number", "Go to Cluster ID"])
     
     if nav_mode == "Go to Page Number":
-        # Input for Page
-        # We use +1 for display (Humans count from 1), but session_state uses 0-index
-        target_page_input = st.number_input("Enter Page #", min_value=1, max_value=total_pages, value=st.session_state.page + 1)
-        if st.button("Jump to Page"):
-            st.session_state.page = target_page_input - 1
-            st.rerun()
+        # The single paginator: +1 for display (Humans count from 1), session_state.page is 0-index
+        st.number_input("Enter Page #", min_value=1, max_value=total_pages, key="page_num", on_change=sync_page)
             
     elif nav_mode == "Go to Cluster ID":
         # Input for Cluster ID
         target_cluster = st.number_input("Enter Cluster ID #", min_value=0, value=0)
         if st.button("Find Cluster"):
-            if target_cluster in all_c_ids:
-                # Find the index of this cluster in the list
-                idx = all_c_ids.index(target_cluster)
+            idx = cid_to_index.get(target_cluster)
+            if idx is None:
+                st.error(f"Cluster {target_cluster} not found in current results.")
+            else:
                 # Calculate which page it falls on
+                # The tabs below render after this, so they already see the new page
                 target_page_calculated = idx // ITEMS_PER_PAGE
                 st.session_state.page = target_page_calculated
+                st.session_state.page_num = target_page_calculated + 1
                 st.success(f"Found! Jumping to Page {target_page_calculated + 1}")
-                st.rerun()
-            else:
-                st.error(f"Cluster {target_cluster} not found in current results.")
 
     st.divider()
     st.metric("Total Library", total_imgs)
@@ -159,19 +285,9 @@ with t1:
     if not all_c_ids:
         st.info("No clusters found. Go to 'Tools' to run detection.")
     else:
-        # Standard Nav Bar
-        c1, c2, c3 = st.columns([1, 4, 1])
-        with c1: 
-            if st.button("⬅️ Previous") and st.session_state.page > 0: 
-                st.session_state.page -= 1
-                st.rerun()
-        with c2: 
-            st.markdown(f"**Page {st.session_state.page + 1} of {total_pages}**")
-            st.caption(f"Showing Clusters for Index {st.session_state.page * ITEMS_PER_PAGE} - {(st.session_state.page + 1) * ITEMS_PER_PAGE}")
-        with c3:
-            if st.button("Next ➡️") and st.session_state.page < total_pages - 1:
-                st.session_state.page += 1
-                st.rerun()
+        # Page Header (paging lives in the sidebar)
+        st.markdown(f"**Page {st.session_state.page + 1} of {total_pages}**")
+        st.caption(f"Showing Clusters for Index {st.session_state.page * ITEMS_PER_PAGE} - {(st.session_state.page + 1) * ITEMS_PER_PAGE}")
                 
         # Slice Data for Current Page
         start = st.session_state.page * ITEMS_PER_PAGE
@@ -179,17 +295,14 @@ with t1:
         
         # RENDER LOOP
         conn = get_db_connection()
-        for cid in current_ids:
+        page_items = fetch_all_cluster_items(conn, current_ids)
+        
+        for cid, items in page_items:
             st.markdown("---")
             st.subheader(f"Cluster #{cid}")
             
-            query = '''SELECT images.path, clusters.is_winner, images.sharpness, images.width, images.height
-                       FROM clusters JOIN images ON clusters.image_id = images.id
-                       WHERE clusters.cluster_id = ?'''
-            items = conn.execute(query, (cid,)).fetchall()
-            
             # Filmstrip
-            filmstrip = create_filmstrip(items, cid)
+            filmstrip = filmstrip_jpeg(items, cid)
             if filmstrip:
                 st.image(filmstrip, use_container_width=False)
             
@@ -208,17 +321,12 @@ with t1:
                 name = os.path.basename(path)
                 with cols[idx+1]:
                     st.write(f"Candidate {idx+1}")
-                    if st.button(f"🏆 Keep This Only\n{name}", key=f"keep_{path}_{cid}"):
+                    if st.button(f"🏆 Keep This Only\n{name}", key=f"keep_{path_key(path)}_{cid}"):
                         keep_one(path, items, cid)
                         st.success("Sorted!")
                         st.rerun()
-        conn.close()
         
         st.markdown("---")
-        if st.button("Next Page ➡️", key="next_btm"):
-             if st.session_state.page < total_pages - 1:
-                st.session_state.page += 1
-                st.rerun()
 
 with t2:
     st.header("Tools")
@@ -227,16 +335,11 @@ with t2:
         os.makedirs(COLLAGE_FOLDER, exist_ok=True)
         st.info("Generating...")
         conn = get_db_connection()
+        all_items = fetch_all_cluster_items(conn)
         prog = st.progress(0)
-        for i, cid in enumerate(all_c_ids):
-            query = '''SELECT images.path, clusters.is_winner, images.sharpness, images.width, images.height
-                       FROM clusters JOIN images ON clusters.image_id = images.id
-                       WHERE clusters.cluster_id = ?'''
-            items = conn.execute(query, (cid,)).fetchall()
-            strip = create_filmstrip(items, cid)
-            if strip:
-                strip.save(os.path.join(COLLAGE_FOLDER, f"Cluster_{cid:05d}.jpg"))
-            if i % 10 == 0: prog.progress((i+1)/len(all_c_ids))
-        conn.close()
+        workers = min(os.cpu_count() or 1, 8)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            for i, _ in enumerate(executor.map(_render_and_save, all_items, chunksize=8)):
+                if i % 10 == 0: prog.progress((i+1)/len(all_items))
         prog.progress(1.0)
         st.success(f"Done! Saved to {COLLAGE_FOLDER}")
\ No newline at end of file
@@ -3,13 +3,29 @@ import re
 import shutil
 import sqlite3
 from collections import Counter
+from functools import lru_cache
+from itertools import groupby
+from operator import itemgetter
 
 # --- CONFIG ---
 DB_FILE = "photo_library.db"
 TARGET_FOLDER = "./data/input_photos"
 OUTPUT_DIR = "sorted_photos"
+# images column caching get_pattern_prefix(). Each sniper version has its own rules, so each
+# gets its own column; bump the suffix whenever get_pattern_prefix changes to recompute it.
+PREFIX_COL = "prefix_v151_r1"
 
 # --- HELPERS ---
+# Compiled once: these run on every filename in the audit and every path in a sort
+_DATE_RE = re.compile(r'^(19|20)\d{6}')
+_PREFIX_RE = re.compile(r'^(.*)[-_]\d+')
+_YEAR_RE = re.compile(r'(19\d{2}|20\d{2})')
+_DIGITS_RE = re.compile(r'\d+')
+
+def _fast_move(src, dst):
+    """os.rename is a single inode update on the same volume; shutil.move copies across volumes."""
+    try: os.rename(src, dst)
+    except OSError: shutil.move(src, dst)
 
 def get_pattern_prefix(filename):
     """Extracts prefix for grouping (e.g. 1997-001 -> 1997)"""
@@ -19,39 +35,52 @@ def get_pattern_prefix(filename):
     if "Screenshot" in filename: return None
     
     # Check for date format YYYYMMDD (ignore)
-    if re.match(r'^(19|20)\d{6}', filename): return None
+    if _DATE_RE.match(filename): return None
     
-    match = re.match(r'^(.*)[-_]\d+', filename)
+    match = _PREFIX_RE.match(filename)
     if match:
         return match.group(1)
     return None
 
+@lru_cache(maxsize=65536)
 def extract_sort_key(filename):
     """
     Returns a tuple (Year, Sequence) for sorting.
     Lower Year = Better. Lower Sequence = Better.
     """
     # Try to find a year
-    year_match = re.search(r'(19\d{2}|20\d{2})', filename)
+    year_match = _YEAR_RE.search(filename)
     year = int(year_match.group(1)) if year_match else 9999
     
     # Try to find a sequence number at the end
-    seq_match = re.findall(r'\d+', filename)
+    seq_match = _DIGITS_RE.findall(filename)
     seq = int(seq_match[-1]) if seq_match else 999999
     
     return (year, seq)
 
+def path_sort_key(path):
+    return extract_sort_key(os.path.basename(path))
+
 # --- STAGE 1: AUDIT ---
 
+def _iter_images(root):
+    """Yields image filenames under root; scandir entries carry their type, so no extra stat."""
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        try:
+            with os.scandir(d) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.lower().endswith(('.jpg', '.png')):
+                        yield entry.name
+        except OSError: continue
+
 def show_targets():
     print("\n🎯 Scanning for Targets (Prefixes with >10 images)...")
-    prefix_counts = Counter()
-    
-    for root, _, files in os.walk(TARGET_FOLDER):
-        for f in files:
-            if f.lower().endswith(('.jpg', '.png')):
-                p = get_pattern_prefix(f)
-                if p: prefix_counts[p] += 1
+    # map/filter/Counter all run in C; only get_pattern_prefix is Python
+    prefix_counts = Counter(filter(None, map(get_pattern_prefix, _iter_images(TARGET_FOLDER))))
                 
     # Filter low counts
     targets = [t for t in prefix_counts.most_common() if t[1] >= 10]
@@ -70,42 +99,58 @@ def show_targets():
 
 # --- STAGE 2: SCOUT ---
 
+def ensure_prefixes(conn):
+    """Stores get_pattern_prefix() per image ('' = none) so scouting is an indexed lookup."""
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(images)")}
+    if PREFIX_COL not in cols:
+        conn.execute(f"ALTER TABLE images ADD COLUMN {PREFIX_COL} TEXT")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_images_{PREFIX_COL} ON images({PREFIX_COL})")
+    # image -> cluster direction, so the target subquery probes instead of scanning clusters per image
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_clusters_iid_cid ON clusters(image_id, cluster_id)")
+    
+    todo = conn.execute(f"SELECT id, path FROM images WHERE {PREFIX_COL} IS NULL").fetchall()
+    if todo:
+        conn.executemany(f"UPDATE images SET {PREFIX_COL} = ? WHERE id = ?",
+                         [(get_pattern_prefix(os.path.basename(p)) or '', img_id) for img_id, p in todo])
+    conn.commit()
+
 def scout_target(target_prefix):
     print(f"\n🕵️  Scouting clusters involving '{target_prefix}'...")
     
     conn = sqlite3.connect(DB_FILE)
     cursor = conn.cursor()
     
-    # Get all cluster IDs
-    c_ids = [x[0] for x in cursor.execute("SELECT DISTINCT cluster_id FROM clusters").fetchall()]
+    ensure_prefixes(conn)
+    
+    # One query: every (cluster, path) row for clusters with a member in the target group
+    query = f'''SELECT c.cluster_id, i.path FROM clusters c JOIN images i ON c.image_id = i.id
+               WHERE c.cluster_id IN (SELECT c2.cluster_id FROM images i2 JOIN clusters c2 ON c2.image_id = i2.id
+                                      WHERE i2.{PREFIX_COL} = ?)
+               ORDER BY c.cluster_id'''
+    rows = cursor.execute(query, (target_prefix,)).fetchall()
     
     affected_clusters = []
     
     print(f"\n{'WINNER (Keep)':<35} | {'LOSER (Discard)':<35}")
     print("-" * 75)
     
-    for cid in c_ids:
-        # Get paths
-        query = "SELECT images.path FROM clusters JOIN images ON clusters.image_id = images.id WHERE clusters.cluster_id = ?"
-        paths = [row[0] for row in cursor.execute(query, (cid,)).fetchall()]
+    for cid, grp in groupby(rows, key=itemgetter(0)):
+        paths = [row[1] for row in grp]
         
-        # Filter: Does this cluster involve our target?
-        if any(target_prefix in os.path.basename(p) for p in paths):
-            
-            # APPLY LOGIC: Sort by (Year Ascending, Sequence Ascending)
-            # This implements "Option B: Prioritize Older Year"
-            paths.sort(key=lambda p: extract_sort_key(os.path.basename(p)))
-            
-            winner = paths[0]
-            losers = paths[1:]
-            
-            # Show sample output
-            w_name = os.path.basename(winner)
-            l_name = os.path.basename(losers[0]) if losers else "---"
-            
-            print(f"{w_name:<35} | {l_name:<35}")
-            
-            affected_clusters.append((cid, winner, losers))
+        # APPLY LOGIC: Sort by (Year Ascending, Sequence Ascending)
+        # This implements "Option B: Prioritize Older Year"
+        paths.sort(key=path_sort_key)
+        
+        winner = paths[0]
+        losers = paths[1:]
+        
+        # Show sample output
+        w_name = os.path.basename(winner)
+        l_name = os.path.basename(losers[0]) if losers else "---"
+        
+        print(f"{w_name:<35} | {l_name:<35}")
+        
+        affected_clusters.append((cid, winner, losers))
             
     conn.close()
     return affected_clusters
@@ -138,20 +183,20 @@ def fire_sniper(cluster_data):
     for cid, winner, losers in cluster_data:
         # Move Winner
         try:
-            shutil.move(winner, os.path.join(keep_dir, os.path.basename(winner)))
+            _fast_move(winner, os.path.join(keep_dir, os.path.basename(winner)))
         except: pass
         
         # Move Losers
         for l in losers:
             if os.path.exists(l):
                 try:
-                    shutil.move(l, os.path.join(disc_dir, os.path.basename(l)))
+                    _fast_move(l, os.path.join(disc_dir, os.path.basename(l)))
                     shots += 1
                 except: pass
                 
-        # Remove from DB
-        cursor.execute("DELETE FROM clusters WHERE cluster_id = ?", (cid,))
-        
+    # Remove from DB in one transaction
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.executemany("DELETE FROM clusters WHERE cluster_id = ?", [(cid,) for cid, _, _ in cluster_data])
     conn.commit()
     conn.close()
     print(f"✅ Done. {shots} files moved to Discards.")
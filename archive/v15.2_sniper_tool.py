@@ -3,12 +3,28 @@ import re
 import shutil
 import sqlite3
 from collections import Counter
+from functools import lru_cache
+from itertools import groupby
+from operator import itemgetter
 
 # --- CONFIG ---
 DB_FILE = "photo_library.db"
 OUTPUT_DIR = "sorted_photos"
+# images column caching get_pattern_prefix(). Each sniper version has its own rules, so each
+# gets its own column; bump the suffix whenever get_pattern_prefix changes to recompute it.
+PREFIX_COL = "prefix_v152_r1"
 
 # --- HELPERS ---
+# Compiled once: these run on every filename in the audit and every path in a sort
+_DATE_RE = re.compile(r'^(19|20)\d{6}')
+_PREFIX_RE = re.compile(r'^(.*)[-_]\d+')
+_YEAR_RE = re.compile(r'(19\d{2}|20\d{2})')
+_DIGITS_RE = re.compile(r'\d+')
+
+def _fast_move(src, dst):
+    """os.rename is a single inode update on the same volume; shutil.move copies across volumes."""
+    try: os.rename(src, dst)
+    except OSError: shutil.move(src, dst)
 
 def get_pattern_prefix(filename):
     """Extracts prefix for grouping (e.g. 1997-001 -> 1997)"""
@@ -17,28 +33,32 @@ def get_pattern_prefix(filename):
     if "2023-08" in filename: return None # Filter out your specific bulk folder
     
     # Check for date format YYYYMMDD (ignore)
-    if re.match(r'^(19|20)\d{6}', filename): return None
+    if _DATE_RE.match(filename): return None
     
-    match = re.match(r'^(.*)[-_]\d+', filename)
+    match = _PREFIX_RE.match(filename)
     if match:
         return match.group(1)
     return None
 
+@lru_cache(maxsize=65536)
 def extract_sort_key(filename):
     """
     Returns a tuple (Year, Sequence) for sorting.
     Lower Year = Better. Lower Sequence = Better.
     """
     # Try to find a year
-    year_match = re.search(r'(19\d{2}|20\d{2})', filename)
+    year_match = _YEAR_RE.search(filename)
     year = int(year_match.group(1)) if year_match else 9999
     
     # Try to find a sequence number at the end
-    seq_match = re.findall(r'\d+', filename)
+    seq_match = _DIGITS_RE.findall(filename)
     seq = int(seq_match[-1]) if seq_match else 999999
     
     return (year, seq)
 
+def path_sort_key(path):
+    return extract_sort_key(os.path.basename(path))
+
 # --- STAGE 1: AUDIT CLUSTERS ---
 
 def scan_database_for_targets():
@@ -57,12 +77,7 @@ def scan_database_for_targets():
         return []
 
     # Count how many times each prefix appears in a duplicate
-    prefix_counts = Counter()
-    for p in paths:
-        fname = os.path.basename(p)
-        prefix = get_pattern_prefix(fname)
-        if prefix:
-            prefix_counts[prefix] += 1
+    prefix_counts = Counter(filter(None, map(get_pattern_prefix, map(os.path.basename, paths))))
             
     # Sort by most duplicates
     targets = prefix_counts.most_common()
@@ -79,39 +94,55 @@ def scan_database_for_targets():
 
 # --- STAGE 2: SCOUT ---
 
+def ensure_prefixes(conn):
+    """Stores get_pattern_prefix() per image ('' = none) so scouting is an indexed lookup."""
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(images)")}
+    if PREFIX_COL not in cols:
+        conn.execute(f"ALTER TABLE images ADD COLUMN {PREFIX_COL} TEXT")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_images_{PREFIX_COL} ON images({PREFIX_COL})")
+    # image -> cluster direction, so the target subquery probes instead of scanning clusters per image
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_clusters_iid_cid ON clusters(image_id, cluster_id)")
+    
+    todo = conn.execute(f"SELECT id, path FROM images WHERE {PREFIX_COL} IS NULL").fetchall()
+    if todo:
+        conn.executemany(f"UPDATE images SET {PREFIX_COL} = ? WHERE id = ?",
+                         [(get_pattern_prefix(os.path.basename(p)) or '', img_id) for img_id, p in todo])
+    conn.commit()
+
 def scout_target(target_prefix):
     print(f"\n🕵️  Scouting clusters involving '{target_prefix}'...")
     
     conn = sqlite3.connect(DB_FILE)
     cursor = conn.cursor()
     
-    # Get all cluster IDs
-    c_ids = [x[0] for x in cursor.execute("SELECT DISTINCT cluster_id FROM clusters").fetchall()]
+    ensure_prefixes(conn)
+    
+    # One query: every (cluster, path) row for clusters with a member in the target group
+    query = f'''SELECT c.cluster_id, i.path FROM clusters c JOIN images i ON c.image_id = i.id
+               WHERE c.cluster_id IN (SELECT c2.cluster_id FROM images i2 JOIN clusters c2 ON c2.image_id = i2.id
+                                      WHERE i2.{PREFIX_COL} = ?)
+               ORDER BY c.cluster_id'''
+    rows = cursor.execute(query, (target_prefix,)).fetchall()
     
     affected_clusters = []
     
     print(f"\n{'WINNER (Keep)':<35} | {'LOSER (Discard)':<35}")
     print("-" * 75)
     
-    for cid in c_ids:
-        # Get paths
-        query = "SELECT images.path FROM clusters JOIN images ON clusters.image_id = images.id WHERE clusters.cluster_id = ?"
-        paths = [row[0] for row in cursor.execute(query, (cid,)).fetchall()]
+    for cid, grp in groupby(rows, key=itemgetter(0)):
+        paths = [row[1] for row in grp]
         
-        # Filter: Does this cluster involve our target?
-        if any(target_prefix in os.path.basename(p) for p in paths):
-            
-            # APPLY LOGIC: Sort by (Year Ascending, Sequence Ascending)
-            paths.sort(key=lambda p: extract_sort_key(os.path.basename(p)))
-            
-            winner = paths[0]
-            losers = paths[1:]
-            
-            w_name = os.path.basename(winner)
-            l_name = os.path.basename(losers[0]) if losers else "---"
-            
-            print(f"{w_name:<35} | {l_name:<35}")
-            affected_clusters.append((cid, winner, losers))
+        # APPLY LOGIC: Sort by (Year Ascending, Sequence Ascending)
+        paths.sort(key=path_sort_key)
+        
+        winner = paths[0]
+        losers = paths[1:]
+        
+        w_name = os.path.basename(winner)
+        l_name = os.path.basename(losers[0]) if losers else "---"
+        
+        print(f"{w_name:<35} | {l_name:<35}")
+        affected_clusters.append((cid, winner, losers))
             
     conn.close()
     return affected_clusters
@@ -140,18 +171,19 @@ def fire_sniper(cluster_data):
     shots = 0
     
     for cid, winner, losers in cluster_data:
-        try: shutil.move(winner, os.path.join(keep_dir, os.path.basename(winner)))
+        try: _fast_move(winner, os.path.join(keep_dir, os.path.basename(winner)))
         except: pass
         
         for l in losers:
             if os.path.exists(l):
                 try:
-                    shutil.move(l, os.path.join(disc_dir, os.path.basename(l)))
+                    _fast_move(l, os.path.join(disc_dir, os.path.basename(l)))
                     shots += 1
                 except: pass
                 
-        cursor.execute("DELETE FROM clusters WHERE cluster_id = ?", (cid,))
-        
+    # Remove from DB in one transaction
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.executemany("DELETE FROM clusters WHERE cluster_id = ?", [(cid,) for cid, _, _ in cluster_data])
     conn.commit()
     conn.close()
     print(f"✅ Done. {shots} files moved to Discards.")
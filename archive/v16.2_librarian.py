@@ -3,9 +3,19 @@ import os
 import shutil
 import sqlite3
 import cv2
+import concurrent.futures
 import numpy as np
 import warnings
-from PIL import Image
+import hashlib
+import time
+import io
+import errno
+from collections import defaultdict
+from PIL import Image, ImageDraw
+try:
+    import numba # Optional: compiles the paper test into one fused pass; NumPy/cv2 path otherwise
+except ImportError:
+    numba = None
 
 # --- SILENCE NOISE ---
 warnings.filterwarnings("ignore")
@@ -15,6 +25,8 @@ os.environ["OPENCV_LOG_LEVEL"] = "OFF"
 DB_FILE = "photo_library.db"
 SOURCE_FOLDER = "./data/input_photos"
 ARCHIVE_FOLDER = "./data/archived_documents"
+THUMB_CACHE = "./cache/thumbs"
+MONTAGE_SIZE = 20
 
 st.set_page_config(page_title="Photo Detective v16.2", layout="wide")
 st.title("🧐 Photo Detective v16.2: Librarian")
@@ -22,32 +34,137 @@ st.title("🧐 Photo Detective v16.2: Librarian")
 # --- ENGINE ---
 
 def get_db_connection():
-    return sqlite3.connect(DB_FILE)
+    conn = sqlite3.connect(DB_FILE, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")
+    return conn
 
-def is_document_candidate(path):
+def cheap_classify(path, size):
     fname = os.path.basename(path).lower()
     keywords = ['screenshot', 'scan', 'screen shot', 'clip', 'capture', 'copy']
     for k in keywords:
         if k in fname: return True, f"Name contains '{k}'"
             
-    if fname.endswith('.png'):
-        try:
-            if os.path.getsize(path) / (1024*1024) < 5: return True, "PNG Format"
-        except: pass
+    if fname.endswith('.png') and size < 5 * 1024 * 1024: return True, "PNG Format"
+    return None
+
+if numba is not None:
+    @numba.njit(cache=True, fastmath=True)
+    def _paper_sums(img):
+        h, w, _ = img.shape
+        v_sum = 0
+        s_sum = 0.0
+        for y in range(h):
+            for x in range(w):
+                b = np.int64(img[y, x, 0]); g = np.int64(img[y, x, 1]); r = np.int64(img[y, x, 2])
+                v = max(b, g, r)
+                if v > 0:
+                    v_sum += v
+                    s_sum += (v - min(b, g, r)) * 255.0 / v
+        return v_sum, s_sum, h * w
 
+_V = _m = None
+
+def expensive_visual(path):
+    global _V, _m
+    fname = os.path.basename(path).lower()
     try:
-        img = cv2.imread(path)
+        flags = cv2.IMREAD_REDUCED_COLOR_8 if fname.endswith(('.jpg', '.jpeg')) else cv2.IMREAD_COLOR
+        img = cv2.imread(path, flags)
         if img is None: return False, ""
-        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-        if hsv[:,:,2].mean() > 160 and hsv[:,:,1].mean() < 30:
-            return True, "Visual: White Paper/Doc"
+        if numba is not None:
+            v_sum, s_sum, n = _paper_sums(img)
+            if v_sum > 160 * n and s_sum < 30 * n:
+                return True, "Visual: White Paper/Doc"
+            return False, ""
+        if _V is None or _V.shape != img.shape[:2]:
+            _V = np.empty(img.shape[:2], np.uint8)
+            _m = np.empty_like(_V)
+        np.max(img, axis=2, out=_V)
+        if cv2.mean(_V)[0] > 160:
+            np.min(img, axis=2, out=_m)
+            np.subtract(_V, _m, out=_m)
+            Sp_mean = cv2.mean(_m.astype(np.float32) * 255 / np.maximum(_V, 1))[0]
+            if Sp_mean < 30:
+                return True, "Visual: White Paper/Doc"
     except: return False, ""
         
     return False, ""
 
+def scan_path(path):
+    if not os.path.exists(path): return False, ""
+    return expensive_visual(path)
+
+def prune_existing(cands):
+    by_dir = defaultdict(list)
+    for c in cands: by_dir[os.path.dirname(c['path'])].append(c)
+    alive = set()
+    for d, items in by_dir.items():
+        try:
+            with os.scandir(d or ".") as it:
+                names = {os.path.normcase(e.name) for e in it}
+        except OSError: continue
+        alive.update(id(c) for c in items if os.path.normcase(os.path.basename(c['path'])) in names)
+    return [c for c in cands if id(c) in alive]
+
+def thumb_path(src):
+    h = hashlib.sha1(src.encode()).hexdigest()
+    return os.path.join(THUMB_CACHE, f"{h}.jpg")
+
+def get_thumb(src):
+    tp = thumb_path(src)
+    try:
+        if os.path.getmtime(tp) >= os.path.getmtime(src): return tp
+    except OSError: pass
+    with Image.open(src) as img:
+        img.draft('RGB', (300,300))
+        img.thumbnail((300,300), Image.Resampling.BILINEAR)
+        os.makedirs(THUMB_CACHE, exist_ok=True)
+        img.convert('RGB').save(tp, "JPEG", quality=80)
+    return tp
+
+def build_montage(items, start=0, cols=4):
+    rows = (len(items) + cols - 1) // cols
+    sheet = Image.new('RGB', (300 * cols, 340 * rows), 'white')
+    draw = ImageDraw.Draw(sheet)
+    missing = []
+    for n, item in enumerate(items):
+        x, y = (n % cols) * 300, (n // cols) * 340
+        if item.get('ignored'):
+            draw.text((x + 130, y + 145), "Kept", fill='green')
+        else:
+            try:
+                with Image.open(get_thumb(item['path'])) as t:
+                    sheet.paste(t, (x + (300 - t.width) // 2, y + (300 - t.height) // 2))
+            except Exception:
+                missing.append(item)
+                draw.text((x + 110, y + 145), "File missing", fill='red')
+        draw.text((x + 5, y + 304), f"{start + n + 1}. {os.path.basename(item['path'])}"[:48], fill='black')
+        draw.text((x + 5, y + 320), item['reason'][:48], fill='gray')
+    return sheet, missing
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def montage_jpeg(entries, start):
+    sheet, _ = build_montage([{'path': p, 'reason': r, 'ignored': ig} for p, r, ig in entries], start)
+    buf = io.BytesIO()
+    sheet.save(buf, "JPEG", quality=85)
+    return buf.getvalue()
+
+def load_scan_cache(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS doc_scan_cache
+                    (path TEXT PRIMARY KEY, mtime REAL, size INTEGER, is_doc INTEGER, reason TEXT)''')
+    return _cached_verdicts(conn)
+
+@st.cache_resource(show_spinner=False)
+def _cached_verdicts(_conn):
+    return {row[0]: row[1:] for row in _conn.execute("SELECT path, mtime, size, is_doc, reason FROM doc_scan_cache")}
+
 # --- UI STATE ---
 if 'doc_candidates' not in st.session_state: st.session_state.doc_candidates = []
 if 'scan_complete' not in st.session_state: st.session_state.scan_complete = False
+st.session_state.doc_candidates = [c for c in st.session_state.doc_candidates if not c.get('ignored')]
 
 # --- SIDEBAR ---
 with st.sidebar:
@@ -58,24 +175,62 @@ with st.sidebar:
         st.session_state.scan_complete = False
         
         conn = get_db_connection()
-        all_paths = [row[0] for row in conn.execute("SELECT path FROM images").fetchall()]
-        conn.close()
+        library_size = conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+        cache = load_scan_cache(conn)
         
-        if not all_paths:
+        if not library_size:
+            conn.close()
             st.error("Database empty.")
         else:
             prog = st.progress(0)
             status = st.empty()
-            found = []
-            total = len(all_paths)
+            last_ui = 0.0
+            hits = []
+            todo = []
+            cached = 0
+            for n, (path,) in enumerate(conn.execute("SELECT path FROM images")):
+                if time.monotonic() - last_ui > 0.1:
+                    status.write(f"Checking {n}/{library_size}...")
+                    last_ui = time.monotonic()
+                try: info = os.stat(path)
+                except OSError: continue
+                hit = cache.get(path)
+                if hit and hit[0] == info.st_mtime and hit[1] == info.st_size:
+                    verdict = (bool(hit[2]), hit[3])
+                else:
+                    verdict = cheap_classify(path, info.st_size)
+                    if verdict is None:
+                        todo.append((n, path, info.st_mtime, info.st_size))
+                        continue
+                cached += 1
+                if verdict[0]: hits.append((n, path, verdict[1]))
+            conn.close()
             
-            for i, path in enumerate(all_paths):
-                if not os.path.exists(path): continue
-                is_doc, reason = is_document_candidate(path)
-                if is_doc: found.append({'path': path, 'reason': reason})
-                if i % 100 == 0:
-                    prog.progress((i+1)/total)
-                    status.write(f"Scanning {i}/{total}... Found {len(found)}")
+            found_count = len(hits)
+            new_rows = []
+            total = len(todo)
+            
+            if todo:
+                with concurrent.futures.ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+                    results = ex.map(scan_path, [t[1] for t in todo], chunksize=64)
+                    for i, ((n, path, mtime, size), (is_doc, reason)) in enumerate(zip(todo, results)):
+                        if is_doc: hits.append((n, path, reason))
+                        new_rows.append((path, mtime, size, int(is_doc), reason))
+                        found_count += is_doc
+                        if time.monotonic() - last_ui > 0.1:
+                            prog.progress((i+1)/total)
+                            status.write(f"Scanning {i}/{total} ({cached} cached)... Found {found_count}")
+                            last_ui = time.monotonic()
+                
+                conn = get_db_connection()
+                conn.execute("BEGIN")
+                conn.executemany("INSERT OR REPLACE INTO doc_scan_cache VALUES (?,?,?,?,?)", new_rows)
+                conn.commit()
+                conn.close()
+                cache.update((r[0], r[1:]) for r in new_rows)
+            
+            hits.sort()  # back to library order
+            found = [{'path': p, 'reason': r} for _, p, r in hits]
             
             st.session_state.doc_candidates = found
             st.session_state.scan_complete = True
@@ -96,38 +251,80 @@ with st.sidebar:
             st.write("When ready, move the rest:")
             
             # THE MOVED BUTTON
-            if st.button(f"📦 Move {count} to Archive", type="primary"):
+            # Fixed key: after an Ignore the label's count is stale until the next full run,
+            # and a label-derived widget ID would drop the click once the list is compacted
+            if st.button(f"📦 Move {count} to Archive", type="primary", key="move_archive"):
                 os.makedirs(ARCHIVE_FOLDER, exist_ok=True)
-                moved_count = 0
-                conn = get_db_connection()
-                cursor = conn.cursor()
+                moved_srcs = []
+                cross_fs = {}  # dst -> src, archive lives on another volume
                 bar = st.progress(0)
+                last_ui = 0.0
                 
                 for i, item in enumerate(st.session_state.doc_candidates):
                     src = item['path']
                     fname = os.path.basename(src)
                     dst = os.path.join(ARCHIVE_FOLDER, fname)
                     
-                    if os.path.exists(dst):
+                    if os.path.exists(dst) or dst in cross_fs:
                         base, ext = os.path.splitext(fname)
                         dst = os.path.join(ARCHIVE_FOLDER, f"{base}_copy{ext}")
                     
                     try:
-                        shutil.move(src, dst)
-                        moved_count += 1
-                        cursor.execute("DELETE FROM images WHERE path = ?", (src,))
-                    except Exception as e: print(f"Error: {e}")
+                        os.rename(src, dst)
+                        moved_srcs.append(src)
+                    except OSError as e:
+                        if e.errno == errno.EXDEV: cross_fs[dst] = src
+                        else: print(f"Error: {e}")
                         
-                    if i % 10 == 0: bar.progress((i+1)/count)
+                    if time.monotonic() - last_ui > 0.1:
+                        bar.progress((i+1)/count)
+                        last_ui = time.monotonic()
+                
+                bar.progress(1.0)
+                if cross_fs:
+                    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as ex:
+                        futures = {ex.submit(shutil.move, src, dst): src for dst, src in cross_fs.items()}
+                        for fut in concurrent.futures.as_completed(futures):
+                            try:
+                                fut.result()
+                                moved_srcs.append(futures[fut])
+                            except Exception as e: print(f"Error: {e}")
+                
+                for src in moved_srcs:
+                    try: os.remove(thumb_path(src))
+                    except OSError: pass
                 
+                # Drop the moved rows in one transaction
+                conn = get_db_connection()
+                conn.execute("BEGIN")
+                conn.executemany("DELETE FROM images WHERE path = ?", ((s,) for s in moved_srcs))
                 conn.commit()
                 conn.close()
+                moved_count = len(moved_srcs)
                 st.success(f"Moved {moved_count} files!")
                 st.session_state.doc_candidates = [] 
                 st.rerun()
         else:
             st.success("List is clean!")
 
+# --- REVIEW GRID ---
+def ignore_selected(key):
+    keep = set(st.session_state[key])
+    for c in st.session_state.doc_candidates:
+        if c['path'] in keep: c['ignored'] = True
+    st.session_state[key] = []
+
+@st.fragment
+def review_grid():
+    candidates = st.session_state.doc_candidates
+    for start in range(0, len(candidates), MONTAGE_SIZE):
+        entries = tuple((c['path'], c['reason'], bool(c.get('ignored'))) for c in candidates[start:start + MONTAGE_SIZE])
+        st.image(montage_jpeg(entries, start))
+    
+    labels = {c['path']: f"{n + 1}. {os.path.basename(c['path'])}" for n, c in enumerate(candidates) if not c.get('ignored')}
+    if st.multiselect("Select photos to keep", list(labels), format_func=labels.get, key="keep"):
+        st.button("Ignore (Keep)", on_click=ignore_selected, args=("keep",))
+
 # --- MAIN AREA ---
 
 if not st.session_state.scan_complete:
@@ -135,7 +332,7 @@ if not st.session_state.scan_complete:
 else:
     # --- AUTO-PRUNE GHOSTS ---
     original_count = len(st.session_state.doc_candidates)
-    st.session_state.doc_candidates = [c for c in st.session_state.doc_candidates if os.path.exists(c['path'])]
+    st.session_state.doc_candidates = prune_existing(st.session_state.doc_candidates)
     
     if original_count != len(st.session_state.doc_candidates):
         st.rerun() # Refresh if we pruned ghosts
@@ -148,20 +345,4 @@ else:
         st.subheader("Review Candidates")
         st.caption("These files will be moved to Archive unless you click 'Ignore'.")
 
-        cols = st.columns(4)
-        for idx, item in enumerate(candidates):
-            col = cols[idx % 4]
-            path = item['path']
-            
-            with col:
-                try:
-                    img = Image.open(path)
-                    img.thumbnail((300,300))
-                    st.image(img, caption=os.path.basename(path))
-                    st.caption(f"{item['reason']}")
-                    
-                    if st.button("Ignore (Keep)", key=path):
-                        candidates.pop(idx)
-                        st.rerun()
-                except Exception:
-                    st.error("File missing")
\ No newline at end of file
+        review_grid()
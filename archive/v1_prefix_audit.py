@@ -5,6 +5,37 @@ from collections import Counter
 # --- CONFIG ---
 # Update this to the folder you want to scan
 TARGET_FOLDER = "./data/input_photos" 
+EXTS = frozenset({'.jpg', '.jpeg', '.png', '.webp', '.heic'})
+
+def _iter_images(root):
+    """Yields image filenames under root; scandir entries carry their type, so no extra stat."""
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        try:
+            with os.scandir(d) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif os.path.splitext(entry.name)[1].lower() in EXTS:
+                        yield entry.name
+        except OSError: continue
+
+# Regex Explanation (one pass per filename):
+# dt branch:  "YYYYMMDD_HHMMSS" stamps -> the Date part is the prefix
+# pre branch: ^(.*) greedy prefix, [-_] at the last hyphen or underscore,
+#             \d+ that is followed immediately by a number
+
+# This handles "1993-B-071" -> Prefix "1993-B"
+# This handles "C-022" -> Prefix "C"
+# This handles "1984-013" -> Prefix "1984"
+
+_PREFIX_RE = re.compile(r'^(?:(?P<dt>\d{8})_\d{6}|(?P<pre>.*)[-_]\d+)')
+
+def file_prefix(f, _match=_PREFIX_RE.match):
+    """Prefix for one filename; unpatterned names (e.g. "img001.jpg") share one bucket."""
+    m = _match(f)
+    return m.group(m.lastgroup) if m else "[No Prefix / Other]"
 
 def identify_prefixes():
     print(f"🕵️  Scanning {TARGET_FOLDER} for naming patterns...")
@@ -13,42 +44,9 @@ def identify_prefixes():
         print("❌ Error: Folder path not found.")
         return
 
-    prefix_counts = Counter()
-    files_scanned = 0
-    
-    # Regex Explanation:
-    # ^(.*?): Capture the prefix at the start (non-greedy)
-    # [-_]:   Stop at the last hyphen or underscore...
-    # \d+:    ...that is followed immediately by a number
-    # [^\/]*$: Ensure we are looking at the filename, not the path
-    
-    # This handles "1993-B-071" -> Prefix "1993-B"
-    # This handles "C-022" -> Prefix "C"
-    # This handles "1984-013" -> Prefix "1984"
-    
-    regex = re.compile(r'^(.*)[-_]\d+')
-
-    for root, _, files in os.walk(TARGET_FOLDER):
-        for f in files:
-            if f.lower().endswith(('.jpg', '.jpeg', '.png', '.webp', '.heic')):
-                files_scanned += 1
-                
-                # Special handling for the "YYYYMMDD_HHMMSS" format
-                # If it looks like a date-time stamp, treat the Date part as the prefix
-                if re.match(r'^\d{8}_\d{6}', f):
-                    prefix = f[:8] # First 8 chars (YYYYMMDD)
-                    prefix_counts[prefix] += 1
-                    continue
-
-                match = regex.match(f)
-                if match:
-                    # We found a pattern like "Prefix-Number"
-                    p = match.group(1)
-                    prefix_counts[p] += 1
-                else:
-                    # No standard separator found (e.g. "img001.jpg")
-                    # We log these as "Unpatterned"
-                    prefix_counts["[No Prefix / Other]"] += 1
+    # Counter tallies the mapped name stream in C; no per-file loop body or += 1
+    prefix_counts = Counter(map(file_prefix, _iter_images(TARGET_FOLDER)))
+    files_scanned = sum(prefix_counts.values())
 
     print(f"   -> Scanned {files_scanned} images.\n")
     
@@ -1,16 +1,25 @@
 import streamlit as st
 import os
+import io
 import shutil
+import threading
+import time
 import cv2
-import imagehash
+import concurrent.futures
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 from datetime import datetime
+from functools import lru_cache
+try:
+    import numba # Optional: fuses the Laplacian + variance into one compiled pass; cv2 path otherwise
+except ImportError:
+    numba = None
 
 # --- CONFIGURATION ---
 DEFAULT_SOURCE = "input_photos"
 KEEPERS_DIR = "sorted_keepers"
 DISCARDS_DIR = "sorted_discards"
+SHARPNESS_EDGE = 512  # Long side the Laplacian runs at
 
 # Ensure output directories exist
 os.makedirs(KEEPERS_DIR, exist_ok=True)
@@ -20,19 +29,57 @@ st.set_page_config(layout="wide", page_title="Visual Photo Sorter")
 
 # --- 1. IMAGE ANALYSIS & SCORING ---
 
+def fast_phash(gray):
+    """imagehash.phash bits, as a 64-bit int, from an already-decoded grayscale array (32x32 area resize + DCT)."""
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8]
+    # cv2.dct is orthonormal; undo the extra 1/sqrt(2) on the DC row/column to match scipy's DCT
+    low[0, :] *= np.sqrt(2)
+    low[:, 0] *= np.sqrt(2)
+    return int.from_bytes(np.packbits(low > np.median(low)).tobytes(), "big")
+
+if numba is not None:
+    @numba.njit(cache=True, fastmath=True)
+    def _laplacian_var(g):
+        """Variance of cv2.Laplacian(g) (3x3, reflect-101 borders) in one pass, no intermediate array."""
+        h, w = g.shape
+        s = 0.0
+        s2 = 0.0
+        for y in range(h):
+            ym = y - 1 if y > 0 else 1
+            yp = y + 1 if y < h - 1 else h - 2
+            for x in range(w):
+                xm = x - 1 if x > 0 else 1
+                xp = x + 1 if x < w - 1 else w - 2
+                v = np.float64(g[ym, x]) + g[yp, x] + g[y, xm] + g[y, xp] - 4.0 * g[y, x]
+                s += v
+                s2 += v * v
+        n = h * w
+        return s2 / n - (s / n) ** 2
+
+def sharpness_of(gray):
+    """Laplacian variance of the (already downscaled) gray image."""
+    if numba is not None and min(gray.shape) > 1: return int(_laplacian_var(gray))
+    return int(cv2.Laplacian(gray, cv2.CV_32F).var())
+
 def calculate_score(image_path):
     """Calculates Sharpness + Resolution Score."""
     try:
-        with Image.open(image_path) as img:
-            img_hash = imagehash.phash(img)
-            width, height = img.size
-            res_score = int((width * height) / 10000)
+        # One grayscale decode feeds the hash, the resolution and the sharpness
+        gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            # OpenCV can't read it: let PIL decode, but hash the same way as everything else
+            with Image.open(image_path) as img:
+                img.draft("L", (64, 64))
+                return {'path': image_path, 'score': 0, 'hash': fast_phash(np.asarray(img.convert("L")))}
+        height, width = gray.shape
+        res_score = int((width * height) / 10000)
 
-        cv_img = cv2.imread(image_path)
-        if cv_img is None: return {'path': image_path, 'score': 0, 'hash': img_hash}
-
-        gray = cv2.cvtColor(cv_img, cv2.COLOR_BGR2GRAY)
-        sharpness = int(cv2.Laplacian(gray, cv2.CV_64F).var())
+        # Laplacian variance only ranks shots within a cluster: run it on a small FP32 copy
+        scale = SHARPNESS_EDGE / max(height, width)
+        if scale < 1: gray = cv2.resize(gray, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+        sharpness = sharpness_of(gray)
+        img_hash = fast_phash(gray)
         
         # Simple composite score
         total_score = sharpness + res_score
@@ -49,6 +96,12 @@ def calculate_score(image_path):
 
 # --- 2. THE FILMSTRIP GENERATOR (VISUALS) ---
 
+@lru_cache(maxsize=8)
+def _font(size):
+    """Parsed once per size; every strip render reuses it."""
+    try: return ImageFont.truetype("arial.ttf", size)
+    except: return ImageFont.load_default()
+
 def create_filmstrip(cluster_items, target_height=500):
     """
     Stitches images side-by-side into a single PIL image.
@@ -56,25 +109,22 @@ def create_filmstrip(cluster_items, target_height=500):
     """
     images = []
     
-    # Try to load a nice font, else default
-    try:
-        font = ImageFont.truetype("arial.ttf", 40)
-        small_font = ImageFont.truetype("arial.ttf", 20)
-    except:
-        font = ImageFont.load_default()
-        small_font = ImageFont.load_default()
+    # A nice font if available, else default
+    font, small_font = _font(40), _font(20)
 
     # Find best score to highlight
     best_score = max(item['score'] for item in cluster_items)
 
     for item in cluster_items:
         try:
-            img = Image.open(item['path']).convert("RGB")
-            
-            # Resize to target height (500px) maintaining aspect ratio
-            aspect_ratio = img.width / img.height
-            new_width = int(target_height * aspect_ratio)
-            img = img.resize((new_width, target_height))
+            with Image.open(item['path']) as src:
+                # JPEG draft: decode at a reduced DCT scale, still >= the strip size
+                src.draft("RGB", (target_height * 4, target_height * 4))
+                
+                # Resize to target height (500px) maintaining aspect ratio
+                aspect_ratio = src.width / src.height
+                new_width = int(target_height * aspect_ratio)
+                img = src.convert("RGB").resize((new_width, target_height), Image.BILINEAR)
             
             # Create a canvas with a border
             is_winner = (item['score'] == best_score)
@@ -119,51 +169,130 @@ def create_filmstrip(cluster_items, target_height=500):
         
     return filmstrip
 
+def _mtime(path):
+    try: return os.path.getmtime(path)
+    except OSError: return 0
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def filmstrip_jpeg(tiles, target_height=500):
+    """JPEG bytes of a cluster's strip; tiles = ((path, mtime, score, sharpness), ...) so reruns reuse it."""
+    strip = create_filmstrip([{'path': p, 'score': sc, 'sharpness': sh} for p, _, sc, sh in tiles], target_height)
+    if not strip: return None
+    buf = io.BytesIO()
+    strip.save(buf, "JPEG", quality=85)
+    return buf.getvalue()
+
 # --- 3. SCANNING LOGIC (CACHED) ---
 
-@st.cache_data(show_spinner=False)
-def scan_structure(source_folder, threshold=16):
-    valid_exts = ('.jpg', '.jpeg', '.png', '.webp', '.heic')
-    all_files = [os.path.join(r, f) for r, _, fs in os.walk(source_folder) for f in fs]
-    
-    image_paths = [f for f in all_files if f.lower().endswith(valid_exts)]
-    non_images = [f for f in all_files if not f.lower().endswith(valid_exts)]
-    
-    # Analysis
+def bk_build(hashes):
+    """BK-tree over int hashes (Hamming metric). Node = [hash, [indices], {dist: child}]."""
+    root = None
+    for idx, h in hashes:
+        if root is None:
+            root = [h, [idx], {}]
+            continue
+        node = root
+        while True:
+            d = (node[0] ^ h).bit_count()
+            if d == 0:
+                node[1].append(idx)
+                break
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [h, [idx], {}]
+                break
+            node = child
+    return root
+
+def bk_find(root, h, threshold):
+    """Indices of every hash within `threshold` bits of h."""
+    found = []
+    stack = [root] if root is not None else []
+    while stack:
+        node = stack.pop()
+        d = (node[0] ^ h).bit_count()
+        if d <= threshold: found.extend(node[1])
+        for k, child in node[2].items():
+            if d - threshold <= k <= d + threshold: stack.append(child)
+    return found
+
+def dsu_find(parent, i):
+    """Union-find root with path halving."""
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def dsu_union(parent, a, b):
+    """Merge two sets; the lower index (better score) stays the root."""
+    ra, rb = dsu_find(parent, a), dsu_find(parent, b)
+    if ra != rb: parent[max(ra, rb)] = min(ra, rb)
+
+def iter_files(root):
+    """Yields DirEntry for every file under root, in os.walk order; the entries keep their stat for the fingerprint."""
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                subdirs = []
+                for entry in it:
+                    if entry.is_dir():
+                        if not entry.is_symlink(): subdirs.append(entry.path)
+                    else:
+                        yield entry
+        except OSError: continue
+        stack.extend(reversed(subdirs))
+
+@st.cache_data(persist="disk", show_spinner=False)
+def analyze_all(fingerprints):
+    """Threshold-independent analysis (int pHashes), keyed on (path, mtime_ns, size) so edits invalidate it."""
+    image_paths = [fp[0] for fp in fingerprints]
     analyzed = []
     bar = st.progress(0, text="Analyzing Image Quality...")
-    for i, p in enumerate(image_paths):
-        analyzed.append(calculate_score(p))
-        if i % 10 == 0: bar.progress(i/len(image_paths))
+    step = max(1, len(image_paths) // 100) # Each update is a websocket round-trip: ~100 per pass
+    # Decode + hash + Laplacian is CPU-bound per file: one worker per core
+    with concurrent.futures.ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+        for i, res in enumerate(ex.map(calculate_score, image_paths, chunksize=8)):
+            analyzed.append(res)
+            if i % step == 0: bar.progress(i/len(image_paths))
     bar.empty()
+    return analyzed
+
+def scan_structure(source_folder, threshold=16):
+    valid_exts = ('.jpg', '.jpeg', '.png', '.webp', '.heic')
+    images, non_images = [], []
+    for entry in iter_files(source_folder):
+        if entry.name.lower().endswith(valid_exts): images.append(entry)
+        else: non_images.append(entry.path)
+    
+    # Analysis (cached across reruns and restarts; only the clustering depends on threshold)
+    fingerprints = tuple((e.path, s.st_mtime_ns, s.st_size) for e in images for s in (e.stat(),))
+    analyzed = analyze_all(fingerprints)
     
     # Clustering
-    clusters = []
-    visited = set()
     analyzed.sort(key=lambda x: x['score'], reverse=True) # Best quality first
     
+    # BK-tree on the 64-bit hash ints: each image only visits the branches within threshold
+    hashes = [x['hash'] for x in analyzed]
+    tree = bk_build((i, h) for i, h in enumerate(hashes) if h is not None)
+    
+    # Union-find over every close pair, so A~B and B~C land together even if A and C are far apart
+    parent = list(range(len(analyzed)))
     c_bar = st.progress(0, text="Building Clusters...")
-    for i, img_a in enumerate(analyzed):
-        if img_a['path'] in visited: continue
-        if img_a['hash'] is None: continue
-        
-        group = [img_a]
-        visited.add(img_a['path'])
-        
-        for j in range(i+1, len(analyzed)):
-            img_b = analyzed[j]
-            if img_b['path'] in visited or img_b['hash'] is None: continue
-            
-            if (img_a['hash'] - img_b['hash']) <= threshold:
-                group.append(img_b)
-                visited.add(img_b['path'])
-        
-        if len(group) > 1:
-            clusters.append(group)
-        
-        if i % 50 == 0: c_bar.progress(i/len(analyzed))
+    step = max(1, len(analyzed) // 100)
+    for i, h in enumerate(hashes):
+        if h is not None:
+            for j in bk_find(tree, h, threshold):
+                if j > i: dsu_union(parent, i, j)
+        if i % step == 0: c_bar.progress(i/len(analyzed))
     c_bar.empty()
     
+    # Groups keep score order (and are ordered by their best member)
+    groups = {}
+    for i, item in enumerate(analyzed):
+        if hashes[i] is not None: groups.setdefault(dsu_find(parent, i), []).append(item)
+    clusters = [g for g in groups.values() if len(g) > 1]
+    
     # Orphans
     clustered_paths = set(item['path'] for group in clusters for item in group)
     orphans = [img for img in analyzed if img['path'] not in clustered_paths]
@@ -172,14 +301,33 @@ def scan_structure(source_folder, threshold=16):
 
 # --- 4. ACTIONS ---
 
+def _fast_move(src, dst):
+    try: os.rename(src, dst)
+    except OSError: shutil.move(src, dst)
+
+def start_auto_clean(srcs):
+    """Moves srcs into Keepers on a background thread; returns the job dict it keeps updated."""
+    job = {'done': 0, 'total': len(srcs), 'finished': False, 'error': None}
+    def run():
+        try:
+            # Renames are latency-bound, not CPU-bound: overlap them in a small thread pool
+            with concurrent.futures.ThreadPoolExecutor(max_workers=8) as ex:
+                for _ in ex.map(_fast_move, srcs, [os.path.join(KEEPERS_DIR, os.path.basename(p)) for p in srcs]):
+                    job['done'] += 1
+        except Exception as e: job['error'] = e
+        finally: job['finished'] = True
+    threading.Thread(target=run, daemon=True).start()
+    return job
+
 def move_group(winner_path, group):
     """Move winner to Keep, others to Discard."""
     fname = os.path.basename(winner_path)
-    shutil.move(winner_path, os.path.join(KEEPERS_DIR, fname))
+    _fast_move(winner_path, os.path.join(KEEPERS_DIR, fname))
+    st.session_state.keepers_count += 1
     
     for item in group:
         if item['path'] != winner_path and os.path.exists(item['path']):
-            shutil.move(item['path'], os.path.join(DISCARDS_DIR, os.path.basename(item['path'])))
+            _fast_move(item['path'], os.path.join(DISCARDS_DIR, os.path.basename(item['path'])))
 
 # --- 5. UI MAIN ---
 
@@ -195,6 +343,7 @@ with st.sidebar:
             st.session_state.data = scan_structure(src, thresh)
             st.session_state.idx = 0
             st.session_state.auto_done = False
+            st.session_state.keepers_count = len(os.listdir(KEEPERS_DIR)) # Counted once; moves keep it current
             st.rerun()
 
 # APP LOGIC
@@ -206,8 +355,17 @@ if 'data' in st.session_state:
     if not st.session_state.auto_done:
         count_o = len(data['orphans'])
         count_n = len(data['non_images'])
-        for o in data['orphans']: shutil.move(o['path'], os.path.join(KEEPERS_DIR, os.path.basename(o['path'])))
-        for n in data['non_images']: shutil.move(n, os.path.join(KEEPERS_DIR, os.path.basename(n)))
+        # Moves run off the script thread; poll so the page shows progress instead of going blank
+        if 'auto_job' not in st.session_state:
+            st.session_state.auto_job = start_auto_clean([o['path'] for o in data['orphans']] + data['non_images'])
+        job = st.session_state.auto_job
+        if not job['finished']:
+            st.progress(job['done'] / max(1, job['total']), text=f"🧹 Moving singles to Safe Keeping... {job['done']}/{job['total']}")
+            time.sleep(0.2)
+            st.rerun()
+        del st.session_state.auto_job
+        if job['error']: raise job['error']
+        st.session_state.keepers_count += job['done']
         st.session_state.auto_done = True
         st.success(f"🧹 Auto-cleaned: {count_o} Singles & {count_n} Files moved to Safe Keeping.")
         st.rerun()
@@ -216,7 +374,7 @@ if 'data' in st.session_state:
     c1, c2, c3 = st.columns(3)
     c1.metric("Total Clusters", len(clusters))
     c2.metric("Remaining", len(clusters) - st.session_state.idx)
-    c3.metric("Files in Keepers", len(os.listdir(KEEPERS_DIR)))
+    c3.metric("Files in Keepers", st.session_state.keepers_count)
     
     st.divider()
 
@@ -231,7 +389,7 @@ if 'data' in st.session_state:
     
     # 1. Generate Filmstrip
     st.subheader(f"Cluster {st.session_state.idx + 1}")
-    filmstrip = create_filmstrip(group, target_height=500)
+    filmstrip = filmstrip_jpeg(tuple((i['path'], _mtime(i['path']), i['score'], i.get('sharpness', 0)) for i in group), 500)
     if filmstrip:
         st.image(filmstrip, caption="Left: Best Quality | Right: Duplicates")
     
@@ -4,6 +4,22 @@ from collections import Counter
 
 # --- CONFIG ---
 TARGET_FOLDER = "./data/input_photos" 
+EXTS = frozenset({'.jpg', '.jpeg', '.png', '.webp', '.heic'})
+
+def _iter_names(root):
+    """Yields file names under root in os.walk order, via scandir (no per-entry stat on most platforms)."""
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                subdirs = []
+                for entry in it:
+                    if entry.is_dir():
+                        if not entry.is_symlink(): subdirs.append(entry.path)
+                    else:
+                        yield entry.name
+        except OSError: continue
+        stack.extend(reversed(subdirs))
 
 def identify_prefixes():
     print(f"🕵️  Scanning {TARGET_FOLDER} for naming patterns...")
@@ -21,24 +37,20 @@ def identify_prefixes():
     # matches "1993-B-071" -> "1993-B"
     regex = re.compile(r'^(.*)[-_]\d+')
 
-    # Regex to identify "YYYYMMDD" (8 digits starting with 19 or 20)
-    # We use this to ignore phone-camera style prefixes
-    date_pattern = re.compile(r'^(19|20)\d{6}$')
-
-    for root, _, files in os.walk(TARGET_FOLDER):
-        for f in files:
-            if f.lower().endswith(('.jpg', '.jpeg', '.png', '.webp', '.heic')):
-                files_scanned += 1
+    for f in _iter_names(TARGET_FOLDER):
+        if os.path.splitext(f)[1].lower() in EXTS:
+            files_scanned += 1
+            
+            match = regex.match(f)
+            if match:
+                p = match.group(1)
                 
-                match = regex.match(f)
-                if match:
-                    p = match.group(1)
+                # FILTER 1: Is this prefix just a full date (YYYYMMDD, starting 19/20)?
+                # We use this to ignore phone-camera style prefixes
+                if len(p) == 8 and p[:2] in ('19', '20') and p.isdecimal():
+                    continue # Skip (likely a phone burst)
                     
-                    # FILTER 1: Is this prefix just a full date (YYYYMMDD)?
-                    if date_pattern.match(p):
-                        continue # Skip (likely a phone burst)
-                        
-                    prefix_counts[p] += 1
+                prefix_counts[p] += 1
 
     print(f"   -> Scanned {files_scanned} images.\n")
     
@@ -1,14 +1,24 @@
 import streamlit as st
 import os
+import io
 import shutil
+import threading
+import time
 import cv2
-import imagehash
+import concurrent.futures
+import numpy as np
 from datetime import datetime
+from functools import lru_cache
 from PIL import Image, ImageDraw, ImageFont, ExifTags
+try:
+    import numba # Optional: fuses the Laplacian + variance into one compiled pass; cv2 path otherwise
+except ImportError:
+    numba = None
 
 # --- CONFIGURATION ---
 DEFAULT_SOURCE = "input_photos"
 OUTPUT_BASE = "sorted_photos"
+SHARPNESS_EDGE = 512  # Long side the Laplacian runs at
 
 # Folders for our workflow
 KEEPERS_DIR = os.path.join(OUTPUT_BASE, "Keepers")
@@ -40,8 +50,8 @@ def parse_date_string(date_str):
 
 def are_time_compatible(data_a, data_b, radius_days=10):
     """Returns True if images are within 'radius_days' of each other."""
-    dt_a = parse_date_string(data_a['date_str'])
-    dt_b = parse_date_string(data_b['date_str'])
+    dt_a = data_a['date_dt'] # Parsed once in calculate_stats, not per pair
+    dt_b = data_b['date_dt']
     
     # If one lacks a date, we assume they might be compatible (loose matching)
     if dt_a is None or dt_b is None: return True
@@ -50,6 +60,39 @@ def are_time_compatible(data_a, data_b, radius_days=10):
     return diff <= radius_days
 
 # --- 2. v5 LOGIC: SCORING & HASHING ---
+def fast_phash(gray):
+    """imagehash.phash bits, as a 64-bit int, from an already-decoded grayscale array (32x32 area resize + DCT)."""
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8]
+    # cv2.dct is orthonormal; undo the extra 1/sqrt(2) on the DC row/column to match scipy's DCT
+    low[0, :] *= np.sqrt(2)
+    low[:, 0] *= np.sqrt(2)
+    return int.from_bytes(np.packbits(low > np.median(low)).tobytes(), "big")
+
+if numba is not None:
+    @numba.njit(cache=True, fastmath=True)
+    def _laplacian_var(g):
+        """Variance of cv2.Laplacian(g) (3x3, reflect-101 borders) in one pass, no intermediate array."""
+        h, w = g.shape
+        s = 0.0
+        s2 = 0.0
+        for y in range(h):
+            ym = y - 1 if y > 0 else 1
+            yp = y + 1 if y < h - 1 else h - 2
+            for x in range(w):
+                xm = x - 1 if x > 0 else 1
+                xp = x + 1 if x < w - 1 else w - 2
+                v = np.float64(g[ym, x]) + g[yp, x] + g[y, xm] + g[y, xp] - 4.0 * g[y, x]
+                s += v
+                s2 += v * v
+        n = h * w
+        return s2 / n - (s / n) ** 2
+
+def sharpness_of(gray):
+    """Laplacian variance of the (already downscaled) gray image."""
+    if numba is not None and min(gray.shape) > 1: return int(_laplacian_var(gray))
+    return int(cv2.Laplacian(gray, cv2.CV_32F).var())
+
 def calculate_stats(image_path):
     """
     The original v5 logic:
@@ -58,19 +101,24 @@ def calculate_stats(image_path):
     - HSV (Saturation)
     """
     try:
-        # 1. PIL for Hashing & EXIF
-        pil_img = Image.open(image_path)
-        img_hash = imagehash.phash(pil_img) # v5 used phash (better than average_hash)
+        # 1. PIL for EXIF only (header read, no pixel decode)
         date_str = get_date_taken(image_path)
         
-        # 2. CV2 for Quality Stats
+        # 2. One CV2 decode for Hashing & Quality Stats
         cv_img = cv2.imread(image_path)
         if cv_img is None: return None
         
         gray = cv2.cvtColor(cv_img, cv2.COLOR_BGR2GRAY)
-        sharpness = int(cv2.Laplacian(gray, cv2.CV_64F).var())
+        # Laplacian variance only ranks shots within a cluster: run it on a small FP32 copy
+        gh, gw = gray.shape
+        scale = SHARPNESS_EDGE / max(gh, gw)
+        if scale < 1: gray = cv2.resize(gray, (int(gw * scale), int(gh * scale)), interpolation=cv2.INTER_AREA)
+        sharpness = sharpness_of(gray)
+        img_hash = fast_phash(gray) # v5 used phash (better than average_hash)
         
-        hsv = cv2.cvtColor(cv_img, cv2.COLOR_BGR2HSV)
+        # Mean saturation barely moves under area downscaling: no full-res HSV pass
+        small_bgr = cv2.resize(cv_img, (256, 256), interpolation=cv2.INTER_AREA)
+        hsv = cv2.cvtColor(small_bgr, cv2.COLOR_BGR2HSV)
         saturation = int(hsv[:, :, 1].mean())
         
         h, w, _ = cv_img.shape
@@ -84,6 +132,7 @@ def calculate_stats(image_path):
             'hash': img_hash,
             'sharpness': sharpness,
             'date_str': date_str,
+            'date_dt': parse_date_string(date_str),
             'total_score': total_score,
             'res': f"{w}x{h}"
         }
@@ -91,34 +140,44 @@ def calculate_stats(image_path):
         return None
 
 # --- 3. v5 LOGIC: COLLAGE GENERATOR (SAVING TO DISK) ---
-def create_and_save_collage(cluster_data, cluster_id):
+@lru_cache(maxsize=8)
+def _font(size):
+    """Parsed once per size; every strip render reuses it."""
+    try: return ImageFont.truetype("arial.ttf", size)
+    except: return ImageFont.load_default()
+
+def _mtime(path):
+    try: return os.path.getmtime(path)
+    except OSError: return 0
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def create_and_save_collage(tiles, cluster_id):
     """
     Generates the side-by-side strip and SAVES it to disk.
     This allows you to check 'Review_Collages' folder for debugging.
+    tiles = ((path, mtime, total_score, sharpness, date_str), ...) is the cache
+    key, so reruns on the same cluster don't re-decode or re-save anything.
+    Returns (save_path, jpeg_bytes).
     """
     target_height = 500
     images = []
     
-    try:
-        font = ImageFont.truetype("arial.ttf", 40)
-        small_font = ImageFont.truetype("arial.ttf", 24)
-    except:
-        font = ImageFont.load_default()
-        small_font = ImageFont.load_default()
+    font, small_font = _font(40), _font(24)
 
     # Sort by score (Best on left)
-    sorted_cluster = sorted(cluster_data, key=lambda x: x['total_score'], reverse=True)
-    best_score = sorted_cluster[0]['total_score']
+    sorted_cluster = sorted(tiles, key=lambda t: t[2], reverse=True)
+    best_score = sorted_cluster[0][2]
 
-    for item in sorted_cluster:
+    for path, _, total_score, sharpness, date_str in sorted_cluster:
         try:
-            img = Image.open(item['path']).convert("RGB")
-            aspect = img.width / img.height
-            new_w = int(target_height * aspect)
-            img = img.resize((new_w, target_height))
+            with Image.open(path) as src:
+                src.draft("RGB", (target_height * 4, target_height * 4))
+                aspect = src.width / src.height
+                new_w = int(target_height * aspect)
+                img = src.convert("RGB").resize((new_w, target_height), Image.BILINEAR)
             
             # Border Color (Green for Winner, Red for Loser)
-            is_winner = (item['total_score'] == best_score)
+            is_winner = (total_score == best_score)
             color = "#32CD32" if is_winner else "#FF4500"
             
             canvas = Image.new("RGB", (new_w + 20, target_height + 80), color)
@@ -126,9 +185,9 @@ def create_and_save_collage(cluster_data, cluster_id):
             
             draw = ImageDraw.Draw(canvas)
             label = "WINNER" if is_winner else "Trash"
-            info = f"Score:{int(item['total_score'])} | Sharp:{item['sharpness']}"
-            if item['date_str']:
-                info += f"\nDate: {item['date_str']}"
+            info = f"Score:{int(total_score)} | Sharp:{sharpness}"
+            if date_str:
+                info += f"\nDate: {date_str}"
             
             draw.text((20, target_height + 20), label, font=font, fill="white")
             draw.text((20, target_height + 55), info, font=small_font, fill="white")
@@ -149,13 +208,95 @@ def create_and_save_collage(cluster_data, cluster_id):
     # Save to Disk (The Feature You Wanted)
     filename = f"Cluster_{cluster_id:04d}.jpg"
     save_path = os.path.join(COLLAGE_DIR, filename)
-    collage.save(save_path)
+    buf = io.BytesIO()
+    collage.save(buf, "JPEG")
+    with open(save_path, "wb") as f:
+        f.write(buf.getvalue())
     
-    return save_path # Return path so app can display it
+    return save_path, buf.getvalue() # Bytes too, so a cached hit never re-reads a file a later scan may have overwritten
 
 # --- 4. THE SCAN ENGINE ---
 
-@st.cache_data(show_spinner=False)
+def bk_build(hashes):
+    """BK-tree over int hashes (Hamming metric). Node = [hash, [indices], {dist: child}]."""
+    root = None
+    for idx, h in hashes:
+        if root is None:
+            root = [h, [idx], {}]
+            continue
+        node = root
+        while True:
+            d = (node[0] ^ h).bit_count()
+            if d == 0:
+                node[1].append(idx)
+                break
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [h, [idx], {}]
+                break
+            node = child
+    return root
+
+def bk_find(root, h, threshold):
+    """Indices of every hash within `threshold` bits of h."""
+    found = []
+    stack = [root] if root is not None else []
+    while stack:
+        node = stack.pop()
+        d = (node[0] ^ h).bit_count()
+        if d <= threshold: found.extend(node[1])
+        for k, child in node[2].items():
+            if d - threshold <= k <= d + threshold: stack.append(child)
+    return found
+
+def dsu_find(parent, i):
+    """Union-find root with path halving."""
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def dsu_union(parent, a, b):
+    """Merge two sets; the lower index (better score) stays the root."""
+    ra, rb = dsu_find(parent, a), dsu_find(parent, b)
+    if ra != rb: parent[max(ra, rb)] = min(ra, rb)
+
+def iter_files(root):
+    """Yields DirEntry for every file under root, in os.walk order; the entries keep their stat for the fingerprint."""
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                subdirs = []
+                for entry in it:
+                    if entry.is_dir():
+                        if not entry.is_symlink(): subdirs.append(entry.path)
+                    else:
+                        yield entry
+        except OSError: continue
+        stack.extend(reversed(subdirs))
+
+@st.cache_data(persist="disk", show_spinner=False)
+def analyze_all(fingerprints):
+    """
+    Stats (int pHashes, parsed dates) for every image. Independent of threshold/time radius, so slider
+    tweaks never re-decode; keyed on (path, mtime_ns, size) so edits invalidate it.
+    """
+    image_files = [fp[0] for fp in fingerprints]
+    analyzed = []
+    prog_bar = st.progress(0)
+    step = max(1, len(image_files) // 100) # Each update is a websocket round-trip: ~100 per pass
+    
+    # Each file is independent and CPU-bound: spread the stats over every core
+    with concurrent.futures.ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+        for i, stats in enumerate(ex.map(calculate_stats, image_files, chunksize=8)):
+            if i % step == 0:
+                prog_bar.progress((i+1)/len(image_files), text=f"Analyzing {i+1}/{len(image_files)}...")
+            if stats: analyzed.append(stats)
+        
+    prog_bar.empty()
+    return analyzed
+
 def run_v5_engine(source_dir, threshold=16, time_radius=10):
     """
     Replicates the nested loop logic of v5.
@@ -166,66 +307,46 @@ def run_v5_engine(source_dir, threshold=16, time_radius=10):
     image_files = []
     non_image_files = []
     
-    for r, _, fs in os.walk(source_dir):
-        for f in fs:
-            path = os.path.join(r, f)
-            if f.lower().endswith(valid_exts):
-                image_files.append(path)
-            else:
-                non_image_files.append(path)
+    for entry in iter_files(source_dir):
+        if entry.name.lower().endswith(valid_exts):
+            image_files.append(entry)
+        else:
+            non_image_files.append(entry.path)
                 
-    # B. Analyze (Stats)
-    analyzed = []
-    prog_bar = st.progress(0)
+    # B. Analyze (Stats) - cached on disk; only the clustering below depends on the sliders
+    fingerprints = tuple((e.path, s.st_mtime_ns, s.st_size) for e in image_files for s in (e.stat(),))
+    analyzed = analyze_all(fingerprints)
     status = st.empty()
-    
-    for i, p in enumerate(image_files):
-        if i % 5 == 0:
-            prog_bar.progress((i+1)/len(image_files))
-            status.text(f"Analyzing {i+1}/{len(image_files)}...")
-        stats = calculate_stats(p)
-        if stats: analyzed.append(stats)
-        
-    prog_bar.empty()
     status.text("✅ Analysis done. Clustering...")
     
-    # C. Cluster (The v5 Nested Loop)
-    clusters = []
-    visited = set()
+    # C. Cluster (The v5 pair test, merged with union-find)
     
     # Sort by quality first
     analyzed.sort(key=lambda x: x['total_score'], reverse=True)
     
+    # BK-tree on the 64-bit pHash ints: the hash check only walks branches within threshold
+    hashes = [x['hash'] for x in analyzed]
+    tree = bk_build(enumerate(hashes))
+    parent = list(range(len(analyzed)))
+    
     c_bar = st.progress(0)
+    step = max(1, len(analyzed) // 100)
     
     for i, img_a in enumerate(analyzed):
-        if img_a['path'] in visited: continue
-        
-        group = [img_a]
-        visited.add(img_a['path'])
-        
-        for j in range(i+1, len(analyzed)):
-            img_b = analyzed[j]
-            if img_b['path'] in visited: continue
-            
-            # The v5 Logic: Hash Check + Time Check
-            sim = img_a['hash'] - img_b['hash']
-            is_match = False
+        # The v5 Logic: Hash Check (BK-tree) + Time Check (only for hash matches)
+        for j in bk_find(tree, hashes[i], threshold):
+            if j > i and are_time_compatible(img_a, analyzed[j], time_radius):
+                dsu_union(parent, i, j) # Transitive: A~B and B~C join even if A and C don't match
             
-            if sim <= threshold:
-                if are_time_compatible(img_a, img_b, time_radius):
-                    is_match = True
-                    
-            if is_match:
-                group.append(img_b)
-                visited.add(img_b['path'])
-        
-        if len(group) > 1:
-            clusters.append(group)
-            
-        if i % 10 == 0: c_bar.progress((i+1)/len(analyzed))
+        if i % step == 0: c_bar.progress((i+1)/len(analyzed))
         
     c_bar.empty()
+    
+    # Groups keep score order (and are ordered by their best member)
+    groups = {}
+    for i, item in enumerate(analyzed):
+        groups.setdefault(dsu_find(parent, i), []).append(item)
+    clusters = [g for g in groups.values() if len(g) > 1]
     status.empty()
     
     # D. Identify Orphans
@@ -240,12 +361,31 @@ def run_v5_engine(source_dir, threshold=16, time_radius=10):
 
 # --- 5. UI & ACTIONS ---
 
+def _fast_move(src, dst):
+    try: os.rename(src, dst)
+    except OSError: shutil.move(src, dst)
+
+def start_auto_clean(srcs):
+    """Moves srcs into Keepers on a background thread; returns the job dict it keeps updated."""
+    job = {'done': 0, 'total': len(srcs), 'finished': False, 'error': None}
+    def run():
+        try:
+            # Renames are latency-bound, not CPU-bound: overlap them in a small thread pool
+            with concurrent.futures.ThreadPoolExecutor(max_workers=8) as ex:
+                for _ in ex.map(_fast_move, srcs, [os.path.join(KEEPERS_DIR, os.path.basename(p)) for p in srcs]):
+                    job['done'] += 1
+        except Exception as e: job['error'] = e
+        finally: job['finished'] = True
+    threading.Thread(target=run, daemon=True).start()
+    return job
+
 def apply_decision(winner_path, group):
     fname = os.path.basename(winner_path)
-    shutil.move(winner_path, os.path.join(KEEPERS_DIR, fname))
+    _fast_move(winner_path, os.path.join(KEEPERS_DIR, fname))
+    st.session_state.keepers_count += 1
     for item in group:
         if item['path'] != winner_path and os.path.exists(item['path']):
-            shutil.move(item['path'], os.path.join(DISCARDS_DIR, os.path.basename(item['path'])))
+            _fast_move(item['path'], os.path.join(DISCARDS_DIR, os.path.basename(item['path'])))
 
 st.title("📸 v5 Logic: The Robust Restorer")
 
@@ -261,6 +401,7 @@ with st.sidebar:
             st.session_state.v5_data = run_v5_engine(src_folder, sim_thresh, time_rad)
             st.session_state.v5_idx = 0
             st.session_state.v5_auto_done = False
+            st.session_state.keepers_count = len(os.listdir(KEEPERS_DIR)) # Counted once; moves keep it current
             st.rerun()
         else:
             st.error("Folder not found.")
@@ -271,11 +412,17 @@ if 'v5_data' in st.session_state:
     
     # --- PHASE 1: AUTOMATION (Singles/Videos) ---
     if not st.session_state.v5_auto_done:
-        # Move Orphans & Non-Images immediately (Clean the room)
-        for o in data['orphans']:
-            shutil.move(o['path'], os.path.join(KEEPERS_DIR, os.path.basename(o['path'])))
-        for n in data['non_images']:
-            shutil.move(n, os.path.join(KEEPERS_DIR, os.path.basename(n)))
+        # Move Orphans & Non-Images (Clean the room) on a background thread, polling for progress
+        if 'v5_auto_job' not in st.session_state:
+            st.session_state.v5_auto_job = start_auto_clean([o['path'] for o in data['orphans']] + data['non_images'])
+        job = st.session_state.v5_auto_job
+        if not job['finished']:
+            st.progress(job['done'] / max(1, job['total']), text=f"Moving singles to Safe Keeping... {job['done']}/{job['total']}")
+            time.sleep(0.2)
+            st.rerun()
+        del st.session_state.v5_auto_job
+        if job['error']: raise job['error']
+        st.session_state.keepers_count += job['done']
             
         st.session_state.v5_auto_done = True
         st.success(f"Auto-Cleaned: {len(data['orphans'])} Singles and {len(data['non_images'])} Videos moved to Safe Keeping.")
@@ -293,14 +440,16 @@ if 'v5_data' in st.session_state:
     c1, c2, c3 = st.columns(3)
     c1.metric("Clusters Found", len(clusters))
     c2.metric("Reviewing", f"{st.session_state.v5_idx + 1} / {len(clusters)}")
-    c3.metric("Files in Output", len(os.listdir(KEEPERS_DIR)))
+    c3.metric("Files in Output", st.session_state.keepers_count)
     
     st.divider()
     
     # DISPLAY (Generate the Collage ONCE and save it)
-    collage_path = create_and_save_collage(group, st.session_state.v5_idx)
-    if collage_path:
-        st.image(collage_path, caption=f"Saved to: {collage_path}")
+    tiles = tuple((i['path'], _mtime(i['path']), i['total_score'], i['sharpness'], i['date_str']) for i in group)
+    collage = create_and_save_collage(tiles, st.session_state.v5_idx)
+    if collage:
+        collage_path, collage_jpeg = collage
+        st.image(collage_jpeg, caption=f"Saved to: {collage_path}")
     
     st.write("### Action")
     
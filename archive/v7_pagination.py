@@ -1,12 +1,20 @@
 import streamlit as st
 import os
+import io
+import sys
 import shutil
 import cv2
-import imagehash
+import numpy as np
 import concurrent.futures
 from datetime import datetime
 from PIL import Image, ImageDraw, ImageFont, ExifTags
 
+# CPU-bound analysis: worker processes, unless this is a free-threaded (no-GIL) build
+if getattr(sys, "_is_gil_enabled", lambda: True)():
+    AnalysisPool = concurrent.futures.ProcessPoolExecutor
+else:
+    AnalysisPool = concurrent.futures.ThreadPoolExecutor
+
 # --- SETUP THE APP LAYOUT ---
 st.set_page_config(page_title="Photo Detective v7 (Paginated)", layout="wide")
 st.title("📸 Photo Detective v7: Paginated Report")
@@ -21,7 +29,7 @@ with st.sidebar:
     sim_threshold = st.slider("Similarity Threshold", 0, 30, 16)
     search_radius = st.slider("Time Search Radius (Days)", 1, 30, 10)
     st.divider()
-    max_workers = st.slider("Speed (CPU Threads)", 1, 16, 4)
+    max_workers = st.slider("Speed (CPU Workers)", 1, 16, 4)
     
     # NEW: Page Size Control
     st.divider()
@@ -32,52 +40,85 @@ with st.sidebar:
 
 # --- CORE LOGIC (UNCHANGED) ---
 
-def get_date_taken(path):
+def read_header(path):
+    """(format, (w, h), EXIF date string) from the file header alone - no pixel decode."""
     try:
         with Image.open(path) as img:
             exif = img.getexif()
-            if not exif: return None
-            date_str = exif.get(36867) or exif.get(306)
-            if date_str: return date_str 
-    except: return None
-    return None
+            date_str = (exif.get(36867) or exif.get(306)) if exif else None
+            return img.format, img.size, date_str or None
+    except: return None, None, None
 
 def parse_date_string(date_str):
     if not date_str: return None
     try: return datetime.strptime(date_str, "%Y:%m:%d %H:%M:%S")
     except: return None
 
+ANALYSIS_EDGE = 1024  # Long side the sharpness/saturation stats run at
+THUMB_HEIGHT = 450    # Collage tile height; the tile is encoded during analysis, not re-decoded later
+
+def fast_phash(gray):
+    """imagehash.phash bits, as a 64-bit int, from an already-decoded grayscale array (32x32 area resize + DCT)."""
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8]
+    # cv2.dct is orthonormal; undo the extra 1/sqrt(2) on the DC row/column to match scipy's DCT
+    low[0, :] *= np.sqrt(2)
+    low[:, 0] *= np.sqrt(2)
+    return int.from_bytes(np.packbits(low > np.median(low)).tobytes(), "big")
+
 def calculate_stats(image_path):
     try:
-        pil_img = Image.open(image_path)
-        img_hash_obj = imagehash.phash(pil_img)
+        fmt, size, date_str = read_header(image_path)
+        
+        # Big JPEGs: libjpeg decodes at 1/2..1/8 scale in the DCT domain - take the smallest still >= ANALYSIS_EDGE
+        flag = cv2.IMREAD_COLOR
+        if fmt == 'JPEG':
+            for factor, reduced in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)):
+                if max(size) // factor >= ANALYSIS_EDGE:
+                    flag = reduced
+                    break
         
-        cv_img = cv2.imread(image_path)
+        # One decode feeds hash, sharpness and saturation (fromfile: non-ASCII paths on Windows)
+        cv_img = cv2.imdecode(np.fromfile(image_path, dtype=np.uint8), flag)
         if cv_img is None: return None
         
+        ch, cw, _ = cv_img.shape
+        w, h = size if size else (cw, ch) # Full resolution from the header, whatever scale we decoded at
+        res_score = int((h * w) / 10000)
+        
+        # Stats only rank shots against each other: run them on an area-downscaled copy, in FP32
+        scale = ANALYSIS_EDGE / max(ch, cw)
+        if scale < 1: cv_img = cv2.resize(cv_img, (int(cw * scale), int(ch * scale)), interpolation=cv2.INTER_AREA)
+        
         gray = cv2.cvtColor(cv_img, cv2.COLOR_BGR2GRAY)
-        sharpness = int(cv2.Laplacian(gray, cv2.CV_64F).var())
+        sharpness = int(cv2.Laplacian(gray, cv2.CV_32F).var())
         
         hsv = cv2.cvtColor(cv_img, cv2.COLOR_BGR2HSV)
         saturation = int(hsv[:, :, 1].mean())
         
-        h, w, _ = cv_img.shape
-        res_score = int((h * w) / 10000)
+        th, tw, _ = cv_img.shape
+        if th > THUMB_HEIGHT:
+            tile = cv2.resize(cv_img, (max(1, round(tw * THUMB_HEIGHT / th)), THUMB_HEIGHT), interpolation=cv2.INTER_AREA)
+        else: tile = cv_img
+        thumb = cv2.imencode('.jpg', tile, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes()
         
         return {
             'path': image_path,
-            'hash_obj': img_hash_obj, 
+            # Plain int: (a ^ b).bit_count() is a pair's distance, and arrays stack it
+            'hash_u64': fast_phash(gray),
             'sharpness': sharpness,
             'saturation': saturation,
             'res': res_score,
-            'date_str': get_date_taken(image_path),
-            'total_score': sharpness + res_score + (saturation * 0.5)
+            'date_str': date_str,
+            'date_dt': parse_date_string(date_str), # Parsed once here, not per candidate pair
+            'total_score': sharpness + res_score + (saturation * 0.5),
+            'thumb': thumb # ~30 KB JPEG for the collage
         }
     except: return None
 
 def are_time_compatible_strict(data_a, data_b, radius):
-    dt_a = parse_date_string(data_a['date_str'])
-    dt_b = parse_date_string(data_b['date_str'])
+    dt_a = data_a['date_dt']
+    dt_b = data_b['date_dt']
     if dt_a is None or dt_b is None: return False
     diff = abs((dt_a - dt_b).days)
     return diff <= radius
@@ -89,12 +130,12 @@ def create_collage(cluster_data, cluster_id, output_folder):
         except: font = ImageFont.load_default()
     except IOError: font = ImageFont.load_default()
 
-    target_height = 450 
+    target_height = THUMB_HEIGHT 
     sorted_cluster = sorted(cluster_data, key=lambda x: x['is_winner'], reverse=True)
 
     for item in sorted_cluster:
         try:
-            img = Image.open(item['path']).convert("RGB")
+            img = Image.open(io.BytesIO(item['thumb'])).convert("RGB")
             aspect_ratio = img.width / img.height
             new_width = int(target_height * aspect_ratio)
             img = img.resize((new_width, target_height))
@@ -127,6 +168,82 @@ def create_collage(cluster_data, cluster_id, output_folder):
         return save_path
     return None
 
+def bk_build(hashes):
+    """BK-tree over int hashes (Hamming metric). Node = [hash, [indices], {dist: child}]."""
+    root = None
+    for idx, h in hashes:
+        if root is None:
+            root = [h, [idx], {}]
+            continue
+        node = root
+        while True:
+            d = (node[0] ^ h).bit_count()
+            if d == 0:
+                node[1].append(idx)
+                break
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [h, [idx], {}]
+                break
+            node = child
+    return root
+
+def bk_find(root, h, threshold):
+    """Indices of every hash within `threshold` bits of h."""
+    found = []
+    stack = [root] if root is not None else []
+    while stack:
+        node = stack.pop()
+        d = (node[0] ^ h).bit_count()
+        if d <= threshold: found.extend(node[1])
+        for k, child in node[2].items():
+            if d - threshold <= k <= d + threshold: stack.append(child)
+    return found
+
+def dsu_find(parent, i):
+    """Union-find root with path halving."""
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def dsu_union(parent, a, b):
+    """Merge two sets; the lower index stays the root, so groups come out in list order."""
+    ra, rb = dsu_find(parent, a), dsu_find(parent, b)
+    if ra != rb: parent[max(ra, rb)] = min(ra, rb)
+
+def iter_files(root):
+    """Yields DirEntry for every file under root, in os.walk order, straight from scandir."""
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                subdirs = []
+                for entry in it:
+                    if entry.is_dir():
+                        if not entry.is_symlink(): subdirs.append(entry.path)
+                    else:
+                        yield entry
+        except OSError: continue
+        stack.extend(reversed(subdirs))
+
+def fast_copy(src, dst):
+    """shutil.copy2, but the kernel moves the bytes (copy_file_range: reflink on btrfs/XFS) where it can."""
+    if hasattr(os, "copy_file_range"):
+        try:
+            with open(src, "rb") as fi, open(dst, "wb") as fo:
+                left = os.fstat(fi.fileno()).st_size
+                while left > 0:
+                    n = os.copy_file_range(fi.fileno(), fo.fileno(), left)
+                    if n == 0: break
+                    left -= n
+            # Some kernels/filesystems return 0 before EOF: redo that file with a plain copy
+            if left == 0:
+                shutil.copystat(src, dst)
+                return
+        except OSError: pass
+    shutil.copy2(src, dst)
+
 # --- MAIN PROCESS ---
 
 # Initialize Session State for Report Data
@@ -151,18 +268,16 @@ if run_button:
         for p in ['Keep', 'Discard', 'Review_Collages']:
             os.makedirs(os.path.join(output_folder, p))
 
-        valid_exts = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+        valid_exts = frozenset({'.jpg', '.jpeg', '.png', '.webp', '.bmp'})
         all_image_files = []
         non_image_files = []
         
         st.write("📂 Scanning file structure...")
-        for root, _, filenames in os.walk(source_folder):
-            for f in filenames:
-                full_path = os.path.join(root, f)
-                if f.lower().endswith(valid_exts):
-                    all_image_files.append(full_path)
-                else:
-                    non_image_files.append(full_path)
+        for entry in iter_files(source_folder):
+            if os.path.splitext(entry.name)[1].lower() in valid_exts:
+                all_image_files.append(entry.path)
+            else:
+                non_image_files.append(entry.path)
         
         st.info(f"Found {len(all_image_files)} images. Processing...")
         
@@ -170,11 +285,10 @@ if run_button:
         status_text = st.empty()
         analyzed_list = []
         
-        # --- MULTITHREADED ANALYSIS ---
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_file = {executor.submit(calculate_stats, f): f for f in all_image_files}
-            for i, future in enumerate(concurrent.futures.as_completed(future_to_file)):
-                stats = future.result()
+        # --- PARALLEL ANALYSIS (processes: PIL holds the GIL; map keeps input order) ---
+        chunk = max(1, len(all_image_files) // (max_workers * 4))
+        with AnalysisPool(max_workers=max_workers) as executor:
+            for i, stats in enumerate(executor.map(calculate_stats, all_image_files, chunksize=chunk)):
                 if stats: analyzed_list.append(stats)
                 
                 pct = (i + 1) / len(all_image_files)
@@ -186,26 +300,27 @@ if run_button:
         
         # --- CLUSTERING ---
         clusters = []
-        visited = set()
         clustered_paths = set() 
         
+        # BK-tree on the int hashes: each image only visits branches within reach of a match
+        hashes = [d['hash_u64'] for d in analyzed_list]
+        tree = bk_build(enumerate(hashes))
+        reach = max(10, sim_threshold)
+        
+        # Union-find over every matching pair: A~B and B~C land together even if A and C don't match
+        parent = list(range(len(analyzed_list)))
         for i, img_a in enumerate(analyzed_list):
-            if img_a['path'] in visited: continue
-            current_cluster = [img_a]
-            visited.add(img_a['path'])
-            
-            for j, img_b in enumerate(analyzed_list):
-                if img_b['path'] in visited: continue
-                sim = img_a['hash_obj'] - img_b['hash_obj']
-                match = False
-                if sim <= 10: match = True
-                elif sim <= sim_threshold:
-                    if are_time_compatible_strict(img_a, img_b, search_radius): match = True
-                
-                if match:
-                    current_cluster.append(img_b)
-                    visited.add(img_b['path'])
-            
+            for j in bk_find(tree, hashes[i], reach):
+                if j <= i: continue
+                # sim <= 10 always matches; up to sim_threshold it also needs the strict time check
+                sim = (hashes[i] ^ hashes[j]).bit_count()
+                if sim <= 10 or are_time_compatible_strict(img_a, analyzed_list[j], search_radius):
+                    dsu_union(parent, i, j)
+        
+        groups = {}
+        for i, img in enumerate(analyzed_list):
+            groups.setdefault(dsu_find(parent, i), []).append(img)
+        for current_cluster in groups.values():
             if len(current_cluster) > 1:
                 clusters.append(current_cluster)
                 for c_img in current_cluster: clustered_paths.add(c_img['path'])
@@ -213,6 +328,7 @@ if run_button:
         # --- MOVING FILES & BUILDING REPORT LIST ---
         trash_count = 0
         cluster_winners_count = 0
+        copies = {} # dst -> src; copied together at the end (a later same-name file still wins, as before)
         
         report_list = [] # Temp list to store collage paths
         
@@ -225,7 +341,7 @@ if run_button:
             for img in cluster:
                 img['is_winner'] = (img == winner) 
                 dest = "Keep" if img['is_winner'] else "Discard"
-                shutil.copy2(img['path'], os.path.join(output_folder, dest, os.path.basename(img['path'])))
+                copies[os.path.join(output_folder, dest, os.path.basename(img['path']))] = img['path']
                 if not img['is_winner']: trash_count += 1
 
             # Generate Collage and SAVE PATH
@@ -242,14 +358,18 @@ if run_button:
         singles_count = 0
         for img in analyzed_list:
             if img['path'] not in clustered_paths:
-                shutil.copy2(img['path'], os.path.join(output_folder, "Keep", os.path.basename(img['path'])))
+                copies[os.path.join(output_folder, "Keep", os.path.basename(img['path']))] = img['path']
                 singles_count += 1
                 
         non_image_count = 0
         for f_path in non_image_files:
-            shutil.copy2(f_path, os.path.join(output_folder, "Keep", os.path.basename(f_path)))
+            copies[os.path.join(output_folder, "Keep", os.path.basename(f_path))] = f_path
             non_image_count += 1
         
+        # Copies are independent and I/O-bound: overlap them in a thread pool
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers * 2) as executor:
+            list(executor.map(fast_copy, copies.values(), copies.keys()))
+        
         # Save results to session state
         st.session_state.report_data = report_list
         st.session_state.report_stats = {